@@ -1,8 +1,18 @@
+import json
+import os
 import random
+import struct
+import sys
+import time
+from chessBook import OpeningBook
+import chessTablebase
+from chessEngine import ChessGame, PIECE_CODES, PIECE_TYPES, EMPTY, WHITE, BLACK, QUEEN, TYPE_MASK
 
 ################################################################################
 #  HEURISTICS
 ################################################################################
+TUNED_ENV = "CHESS_TUNED_SCORES"  # environment variable naming a chessTune.py file to evaluate with
+
 piece_score = {"king": 0, "queen": 9, "rook": 5, "bishop": 3, "knight": 3, "pawn": 1}
 
 knight_scores = [[0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0],
@@ -60,44 +70,538 @@ king_scores = [[0.3, 0.2, 0.2, 0.1, 0.1, 0.2, 0.2, 0.3],
                [0.8, 0.9, 0.7, 0.6, 0.6, 0.7, 0.9, 0.8]]
 
 
-piecePositionScores = {"white_knight": knight_scores,
-                         "black_knight": knight_scores[::-1],
-                         "white_bishop": bishop_scores,
-                         "black_bishop": bishop_scores[::-1],
-                         "white_queen": queen_scores,
-                         "black_queen": queen_scores[::-1],
-                         "white_rook": rook_scores,
-                         "black_rook": rook_scores[::-1],
-                         "white_pawn": pawn_scores,
-                         "black_pawn": pawn_scores[::-1],
-                         "white_king": king_scores,
-                         "black_king": king_scores[::-1]}
+positionTables = {"knight": knight_scores, "bishop": bishop_scores, "rook": rook_scores,
+                  "queen": queen_scores, "pawn": pawn_scores, "king": king_scores}
+
+def readTunedScores(path):
+    """(piece values, position tables by piece name) from a file written by chessTune.py, in the
+    same layout as piece_score and the tables above."""
+    with open(path) as file:
+        tuned = json.load(file)
+    return tuned["piece_score"], tuned["tables"]
+
+def buildPositionScores(tables):
+    """Position tables by piece code name; black's are white's with the ranks reversed."""
+    positionScores = {}
+    for name, scores in tables.items():
+        positionScores["white_" + name] = scores
+        positionScores["black_" + name] = scores[::-1]
+    return positionScores
+
+# tables tuned by chessTune.py replace the hand-written ones only when asked for, and never silently
+if os.environ.get(TUNED_ENV):
+    piece_score, positionTables = readTunedScores(os.environ[TUNED_ENV])
+    print(f"chessAI: evaluating with the tuned values and tables in {os.environ[TUNED_ENV]}", file=sys.stderr)
+piecePositionScores = buildPositionScores(positionTables)
+
+# material value by piece type code, for capture ordering
+pieceTypeValues = [0] * 8
+for name, code in PIECE_TYPES.items():
+    pieceTypeValues[code] = piece_score[name]
+
+def buildPieceSquareScores(pieceValues=piece_score, positionScores=piecePositionScores):
+    """Material plus position score for every piece code, indexed by square (row * 8 + col)."""
+    table = [None] * (max(PIECE_CODES.values()) + 1)
+    for name, scores in positionScores.items():
+        table[PIECE_CODES[name]] = [pieceValues[name.split("_")[1]] + scores[sq >> 3][sq & 7] for sq in range(64)]
+    return table
+
+pieceSquareScores = buildPieceSquareScores()
+# games keep running totals of these scores, so scoreBoard only reads them
+ChessGame.pieceSquareScores = pieceSquareScores
 
 CHECKMATE = 1000
 STALEMATE = 0
-DEPTH = 2
+DRAW = 0  # repetition, fifty-move rule or insufficient material
+TIME_LIMIT = 2.0  # seconds per move
+MAX_DEPTH = 32
+MAX_PLY = 64
+QUIESCENCE_DEPTH = 8   # plies of captures searched past the nominal depth
+DELTA_MARGIN = 2       # pawns of positional slack allowed before a capture is pruned as hopeless
+TT_SIZE_MB = 16
+DEBUG_EVAL = False  # check the incremental totals against a full board scan at every leaf
+SEARCH_STATS = False  # collect SearchStats in every search, not just when findBestMove asks for them
+TABLEBASE_PIECES = 4    # probe the endgame tablebases once this few pieces are left, kings included
+TABLEBASE_WIN = 500     # score of a tablebase win, less a hundredth of a pawn per ply to mate
+BOOK_PATH = "book.bin"  # opening book findBestMove plays from, if the file exists (see chessBook.py)
+
+# selective search, each of which can be switched off to measure what it is worth
+USE_PVS = True        # principal variation search: moves after the first get a null window first
+USE_NULL_MOVE = True  # null-move pruning
+USE_LMR = True        # late move reductions
+NULL_WINDOW = 0.001   # narrower than any difference between two evaluation scores
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_DEPTH = 3
+LMR_MIN_DEPTH = 3
+LMR_MIN_MOVES = 3     # moves searched at full depth before reductions start
+LMR_REDUCTION = 1
+
+################################################################################
+#  TRANSPOSITION TABLE
+################################################################################
+EXACT = 1
+LOWER_BOUND = 2
+UPPER_BOUND = 3
+DOUBLE = struct.Struct('d')
+DOUBLE_BITS = struct.Struct('Q')
+
+class TranspositionTable:
+    """Fixed-size hash table of search results indexed by the low bits of ChessGame.zobristKey.
+    Entries live in flat typed views of one buffer, so the memory cap is exact, no objects are allocated
+    per entry, and the buffer can be shared memory.
+
+    Processes sharing the buffer write entries field by field without locking, so an entry can be read
+    half way through being overwritten. The key is therefore stored XORed with the entry's data
+    (lockless hashing): a torn entry no longer matches its key and the probe misses instead of
+    returning another position's score."""
+    # key (8) + score (8) + best move ID (2) + depth, bound and age (1 each)
+    ENTRY_SIZE = 21
+
+    def __init__(self, sizeMB=TT_SIZE_MB, buffer=None):
+        """buffer, if given, is existing memory of at least bytesNeeded(sizeMB) bytes to keep the entries
+        in - a multiprocessing SharedMemory buffer lets several search processes share one table."""
+        self.size = self.entriesFor(sizeMB)
+        self.mask = self.size - 1
+        self.age = 0
+        size = self.size
+        if buffer is None:
+            buffer = bytearray(size * self.ENTRY_SIZE)
+        self.buffer = memoryview(buffer)[:size * self.ENTRY_SIZE]
+        # one flat typed view per field, widest first so every view stays aligned
+        self.keys = self.buffer[:8 * size].cast('Q')
+        self.scores = self.buffer[8 * size:16 * size].cast('Q')  # the bits of the float score
+        self.moves = self.buffer[16 * size:18 * size].cast('H')
+        self.depths = self.buffer[18 * size:19 * size].cast('b')
+        self.bounds = self.buffer[19 * size:20 * size]  # 0 marks an empty slot
+        self.ages = self.buffer[20 * size:21 * size]
+
+    @classmethod
+    def entriesFor(cls, sizeMB):
+        entries = 1
+        while entries * 2 * cls.ENTRY_SIZE <= sizeMB * 1024 * 1024:
+            entries *= 2
+        return entries
+
+    @classmethod
+    def bytesNeeded(cls, sizeMB):
+        return cls.entriesFor(sizeMB) * cls.ENTRY_SIZE
+
+    def clear(self):
+        self.buffer[:] = bytes(len(self.buffer))
+
+    def release(self):
+        # a shared buffer can only be closed once no views of it are left
+        for view in (self.keys, self.scores, self.moves, self.depths, self.bounds, self.ages, self.buffer):
+            view.release()
+
+    def newSearch(self):
+        # entries from earlier searches stay usable but become the first to be replaced
+        self.age = (self.age + 1) & 255
+
+    def probe(self, key):
+        """Returns (depth, bound, score, moveID) stored for key, or None."""
+        index = key & self.mask
+        bound = self.bounds[index]
+        if bound:
+            # every field is read once, so the check covers exactly the values returned
+            scoreBits, moveID, depth = self.scores[index], self.moves[index], self.depths[index]
+            if self.keys[index] ^ scoreBits ^ (moveID | (depth & 255) << 16 | bound << 24) == key:
+                return depth, bound, DOUBLE.unpack(DOUBLE_BITS.pack(scoreBits))[0], moveID
+        return None
+
+    def store(self, key, depth, bound, score, moveID):
+        index = key & self.mask
+        oldBound = self.bounds[index]
+        oldData = self.scores[index] ^ (self.moves[index] | (self.depths[index] & 255) << 16 | oldBound << 24)
+        # replace empty slots, the same position, entries left over from an older search,
+        # or anything searched less deeply than this result
+        if (not oldBound or self.keys[index] ^ oldData == key or self.ages[index] != self.age
+                or depth >= self.depths[index]):
+            scoreBits = DOUBLE_BITS.unpack(DOUBLE.pack(score))[0]
+            self.keys[index] = key ^ scoreBits ^ (moveID | (depth & 255) << 16 | bound << 24)
+            self.scores[index] = scoreBits
+            self.moves[index] = moveID
+            self.depths[index] = depth
+            self.bounds[index] = bound
+            self.ages[index] = self.age
+
+# kept for the whole game so transpositions found on earlier moves are not searched again
+transpositionTable = TranspositionTable()
+
+################################################################################
+#  OPENING BOOK
+################################################################################
+openingBook = None  # opened on first use, so processes that never probe it never map it
+
+def probeBook(gc, moves=None):
+    """A move from the book at BOOK_PATH for gc's position, taken from moves when given, or None."""
+    global openingBook
+    if openingBook is None or openingBook.path != BOOK_PATH:
+        if not os.path.exists(BOOK_PATH):
+            return None
+        openingBook = OpeningBook(BOOK_PATH)
+    return openingBook.probe(gc, moves)
+
+################################################################################
+#  SEARCH
+################################################################################
+class SearchStopped(Exception):
+    """Raised inside the search when its time or node budget runs out."""
+
+class SearchStats:
+    """Counters describing how a search spent its effort, for comparing versions of the engine.
+    Collecting them costs a little, so the search only does it when asked; times are in seconds."""
+    def __init__(self):
+        self.depth = 0             # deepest completed iteration
+        self.selDepth = 0          # deepest ply reached, quiescence included
+        self.nodes = 0
+        self.qNodes = 0
+        self.elapsed = 0.0
+        self.betaCutoffs = 0
+        self.firstMoveCutoffs = 0  # cutoffs by the first move searched, a measure of move ordering
+        self.ttProbes = 0
+        self.ttHits = 0
+        self.ttCutoffs = 0
+        self.nullMoveCutoffs = 0
+        self.tablebaseHits = 0
+        self.pvsReSearches = 0     # null window searches that failed high and were searched again
+        self.lmrReSearches = 0     # reduced searches that failed high and were searched again
+        self.moveGenTime = 0.0
+        self.evalTime = 0.0
+
+    def generateMoves(self, generator):
+        start = time.perf_counter()
+        moves = generator()
+        self.moveGenTime += time.perf_counter() - start
+        return moves
+
+    def evaluate(self, evaluator, gc):
+        start = time.perf_counter()
+        score = evaluator(gc)
+        self.evalTime += time.perf_counter() - start
+        return score
+
+    def timeMoves(self, moves):
+        """Passes on the moves of a lazy generator, timing how long each takes to produce."""
+        while True:
+            start = time.perf_counter()
+            move = next(moves, None)
+            self.moveGenTime += time.perf_counter() - start
+            if move is None:
+                return
+            yield move
+
+    @property
+    def nodesPerSecond(self):
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+    def toDict(self):
+        return {"depth": self.depth, "seldepth": self.selDepth, "nodes": self.nodes, "qnodes": self.qNodes,
+                "time": round(self.elapsed, 4), "nps": round(self.nodesPerSecond),
+                "cutoffs": self.betaCutoffs, "firstMoveCutoffs": self.firstMoveCutoffs,
+                "firstMoveCutoffRate": round(self.firstMoveCutoffs / self.betaCutoffs, 4) if self.betaCutoffs else 0.0,
+                "ttProbes": self.ttProbes, "ttHits": self.ttHits, "ttCutoffs": self.ttCutoffs,
+                "nullMoveCutoffs": self.nullMoveCutoffs, "tablebaseHits": self.tablebaseHits, "pvsReSearches": self.pvsReSearches,
+                "lmrReSearches": self.lmrReSearches,
+                "moveGenTime": round(self.moveGenTime, 4), "evalTime": round(self.evalTime, 4)}
 
-def findMoveNegaMaxAlphaBeta(gc, validMoves, depth, alpha, beta, turn_multiplier):
-    global nextMove
+    def toJSON(self):
+        return json.dumps(self.toDict())
+
+class SearchState:
+    """Bookkeeping for one findBestMove call: limits, node count and the principal variation."""
+    def __init__(self, timeLimit=None, nodeLimit=None, stopEvent=None, table=None, stats=None):
+        self.startTime = time.perf_counter()
+        self.stats = stats  # a SearchStats to fill in, or None to skip the bookkeeping
+        self.table = table if table is not None else transpositionTable
+        self.stopEvent = stopEvent  # anything with is_set(), so another thread or process can stop the search
+        self.deadline = self.startTime + timeLimit if timeLimit is not None else None
+        self.nodeLimit = nodeLimit
+        self.nodes = 0
+        self.qNodes = 0  # nodes visited by quiescenceSearch, included in nodes
+        self.rootDepth = 0
+        self.pvTable = [[] for ply in range(MAX_PLY + 1)]
+        self.previousPV = []  # principal variation of the last completed iteration
+        self.killers = [[0, 0] for ply in range(MAX_PLY + 1)]  # two quiet cutoff move IDs per ply
+        self.history = [0] * (32 * 64)  # quiet cutoff counts indexed by piece * 64 + target square
+        # read once, so switching them mid-search (another engine in the same process) changes nothing
+        self.usePVS = USE_PVS
+        self.useNullMove = USE_NULL_MOVE
+        self.useLMR = USE_LMR
+
+    def checkLimits(self):
+        # the first iteration always completes so there is a move to play
+        if self.rootDepth <= 1:
+            return
+        if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            raise SearchStopped()
+        if self.nodes & 1023 == 0:
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                raise SearchStopped()
+            if self.stopEvent is not None and self.stopEvent.is_set():
+                raise SearchStopped()
+
+class SearchResult:
+    def __init__(self, move, score, depth, pv, nodes, elapsed, qNodes=0, stats=None, fromBook=False):
+        self.move = move
+        self.score = score      # from the point of view of the side to move
+        self.depth = depth      # deepest completed iteration
+        self.pv = pv
+        self.nodes = nodes
+        self.qNodes = qNodes
+        self.elapsed = elapsed
+        self.stats = stats      # SearchStats, when they were collected
+        self.fromBook = fromBook  # the move came from the opening book, nothing was searched
+
+def findMoveNegaMaxAlphaBeta(gc, validMoves, depth, alpha, beta, turn_multiplier, state, ply=0):
+    """validMoves is the root's move list; every other node passes None and generates its moves
+    lazily with ChessGame.generateMoves."""
+    state.nodes += 1
+    state.checkLimits()
+    state.pvTable[ply] = []
+    if ply > 0:
+        # a single repeat is enough to call the line a draw here, since whoever could avoid it
+        # would already have done so
+        if gc.isRepetition() or gc.hasInsufficientMaterial():
+            return DRAW
+        # unless the move that used up the fifty moves gave mate
+        if gc.halfmoveClock >= 100 and (not gc.inCheck() or gc.hasLegalMove()):
+            return DRAW
+        if sum(gc.pieceCounts) <= TABLEBASE_PIECES:
+            found = chessTablebase.probe(gc)
+            if found is not None:
+                if state.stats is not None:
+                    state.stats.tablebaseHits += 1
+                return tablebaseScore(*found, ply)
     if depth == 0:
-        return turn_multiplier * scoreBoard(gc)
-    # move ordering - implement later
-    max_score = -CHECKMATE
-    for move in validMoves:
+        # leaves are not generated any more, so stalemate is looked for only where it really
+        # happens: when the side to move has nothing left but pawns and the king
+        if not gc.hasPieces(WHITE if gc.whiteToMove else BLACK) and not gc.hasLegalMove():
+            return -CHECKMATE if gc.inCheck() else STALEMATE
+        return quiescenceSearch(gc, alpha, beta, turn_multiplier, state, ply, 0)
+    
+    alphaOrig = alpha
+    hashMoveID = 0
+    stats = state.stats
+    entry = state.table.probe(gc.zobristKey)
+    if stats is not None:
+        stats.ttProbes += 1
+        stats.ttHits += entry is not None
+    if entry is not None:
+        entryDepth, bound, entryScore, hashMoveID = entry
+        # never cut at the root, it still has to pick a move
+        if ply > 0 and entryDepth >= depth:
+            if bound == EXACT or (bound == LOWER_BOUND and entryScore >= beta) or (bound == UPPER_BOUND and entryScore <= alpha):
+                if stats is not None:
+                    stats.ttCutoffs += 1
+                return entryScore
+            if bound == LOWER_BOUND and entryScore > alpha:
+                alpha = entryScore
+            elif bound == UPPER_BOUND and entryScore < beta:
+                beta = entryScore
+
+    inCheck = gc.inCheck()
+    # null move: if the opponent still fails high after we pass, a real move would do at least as
+    # well. Never in check, never twice in a row, and never with only pawns left, where passing
+    # could be better than any legal move (zugzwang)
+    if (state.useNullMove and ply > 0 and depth >= NULL_MOVE_MIN_DEPTH and not inCheck and beta < CHECKMATE
+            and gc.moveLog[-1] is not None and gc.hasPieces(WHITE if gc.whiteToMove else BLACK)
+            and turn_multiplier * staticEvaluation(gc) >= beta):
+        gc.makeNullMove()
+        score = -findMoveNegaMaxAlphaBeta(gc, None, max(depth - 1 - NULL_MOVE_REDUCTION, 0), -beta,
+                                          -beta + NULL_WINDOW, -turn_multiplier, state, ply + 1)
+        gc.undoMove()
+        if score >= beta:
+            if stats is not None:
+                stats.nullMoveCutoffs += 1
+            # a mate found after passing proves nothing about the real moves
+            return beta if score >= CHECKMATE else score
+
+    if validMoves is not None:
+        orderMoves(validMoves, hashMoveID, ply, state)
+        moves = validMoves
+    else:
+        # the move the last iteration's principal variation played here, if nothing better is stored
+        if not hashMoveID and ply < len(state.previousPV):
+            hashMoveID = state.previousPV[ply].moveID
+        moves = gc.generateMoves(hashMoveID, captureRank, quietRanker(ply, state))
+        if stats is not None:
+            moves = stats.timeMoves(moves)
+    killers = state.killers[ply]
+    
+    max_score = -CHECKMATE - 1
+    bestMove = None
+    for moveIndex, move in enumerate(moves):
         gc.movePiece(move)
-        next_moves = gc.getAllLegalMoves()
-        score = -findMoveNegaMaxAlphaBeta(gc, next_moves, depth - 1, -beta, -alpha, -turn_multiplier)
+        if moveIndex == 0:
+            score = -findMoveNegaMaxAlphaBeta(gc, None, depth - 1, -beta, -alpha, -turn_multiplier, state, ply + 1)
+        else:
+            # late quiet moves are searched less deeply, unless they are killers or check either king
+            reduction = 0
+            if (state.useLMR and moveIndex >= LMR_MIN_MOVES and depth >= LMR_MIN_DEPTH and not inCheck
+                    and move.pieceCaptured == EMPTY and not move.isPawnPromotion and move.moveID not in killers
+                    and not gc.inCheck()):
+                reduction = LMR_REDUCTION
+            # with PVS the first try only asks whether the move beats alpha
+            window = -alpha - NULL_WINDOW if state.usePVS else -beta
+            score = -findMoveNegaMaxAlphaBeta(gc, None, depth - 1 - reduction, window, -alpha, -turn_multiplier,
+                                              state, ply + 1)
+            if reduction and score > alpha:
+                if stats is not None:
+                    stats.lmrReSearches += 1
+                score = -findMoveNegaMaxAlphaBeta(gc, None, depth - 1, window, -alpha, -turn_multiplier,
+                                                  state, ply + 1)
+            if state.usePVS and alpha < score < beta:
+                if stats is not None:
+                    stats.pvsReSearches += 1
+                score = -findMoveNegaMaxAlphaBeta(gc, None, depth - 1, -beta, -alpha, -turn_multiplier,
+                                                  state, ply + 1)
+        gc.undoMove()
         if score > max_score:
             max_score = score
-            if depth == DEPTH:
-                nextMove = move
-        gc.undoMove()
+            bestMove = move
+            if score > alpha:
+                state.pvTable[ply] = [move] + state.pvTable[ply + 1]
         if max_score > alpha:
             alpha = max_score
         if alpha >= beta:
+            if stats is not None:
+                stats.betaCutoffs += 1
+                stats.firstMoveCutoffs += moveIndex == 0
+            if move.pieceCaptured == EMPTY and not move.isPawnPromotion:
+                if killers[0] != move.moveID:
+                    killers[1] = killers[0]
+                    killers[0] = move.moveID
+                state.history[move.pieceMoved * 64 + move.endSq] += depth * depth
             break
+    if bestMove is None:  # no legal moves
+        return -CHECKMATE if inCheck else STALEMATE
+    
+    if max_score <= alphaOrig:
+        bound = UPPER_BOUND
+    elif max_score >= beta:
+        bound = LOWER_BOUND
+    else:
+        bound = EXACT
+    state.table.store(gc.zobristKey, depth, bound, max_score, bestMove.moveID)
     return max_score
 
+def tablebaseScore(result, plies, ply=0):
+    """Search score of a tablebase result for the side to move, ply plies from the root. Wins rank
+    below real mates, which carry no distance, and lose a hundredth of a pawn per ply from the root
+    to the mate so the quickest one is played."""
+    if result == 0:
+        return DRAW
+    if plies == 0:
+        return -CHECKMATE
+    return result * (TABLEBASE_WIN - (ply + plies) * 0.01)
+
+def quiescenceSearch(gc, alpha, beta, turn_multiplier, state, ply, qDepth):
+    """Searches captures (and every reply to check) past the nominal depth so leaves are not
+    scored in the middle of an exchange. The side to move may stand pat on the static score."""
+    state.nodes += 1
+    state.qNodes += 1
+    state.checkLimits()
+    state.pvTable[ply] = []
+    stats = state.stats
+    if stats is not None and ply > stats.selDepth:
+        stats.selDepth = ply
+
+    if gc.inCheck():
+        # no standing pat in check: every evasion is searched, and none means checkmate
+        moves = gc.getAllLegalMoves() if stats is None else stats.generateMoves(gc.getAllLegalMoves)
+        if len(moves) == 0:
+            return turn_multiplier * scoreBoard(gc)
+        standPat = -CHECKMATE - 1
+    else:
+        standPat = turn_multiplier * (staticEvaluation(gc) if stats is None else stats.evaluate(staticEvaluation, gc))
+        if standPat >= beta or qDepth >= QUIESCENCE_DEPTH:
+            return standPat
+        # even winning a queen would not get back to alpha
+        if standPat + pieceTypeValues[QUEEN] + DELTA_MARGIN < alpha:
+            return standPat
+        if standPat > alpha:
+            alpha = standPat
+        moves = gc.getCaptureMoves() if stats is None else stats.generateMoves(gc.getCaptureMoves)
+    moves.sort(key=captureRank, reverse=True)
+
+    best = standPat
+    for move in moves:
+        # delta pruning: skip captures that cannot raise the score to alpha
+        if (standPat > -CHECKMATE and not move.isPawnPromotion
+                and standPat + pieceTypeValues[move.pieceCaptured & TYPE_MASK] + DELTA_MARGIN < alpha):
+            continue
+        gc.movePiece(move)
+        score = -quiescenceSearch(gc, -beta, -alpha, -turn_multiplier, state, ply + 1, qDepth + 1)
+        gc.undoMove()
+        if score > best:
+            best = score
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+    return best
+
+def collectPV(gc, pv, depth, table):
+    """Transposition table cutoffs leave the collected PV short, so it is extended by following
+    the stored best moves from the end of the line."""
+    pv = list(pv)
+    for move in pv:
+        gc.movePiece(move)
+    while len(pv) < depth:
+        entry = table.probe(gc.zobristKey)
+        if entry is None:
+            break
+        move = next((m for m in gc.getAllLegalMoves() if m.moveID == entry[3]), None)
+        if move is None:
+            break
+        pv.append(move)
+        gc.movePiece(move)
+    for move in pv:
+        gc.undoMove()
+    return pv
+
+def orderMoves(moves, hashMoveID, ply, state):
+    """Sorts moves best-first: the hash move and the previous iteration's PV move, then captures by
+    most valuable victim / least valuable attacker, then killer moves, then quiet moves by history.
+    The sort is stable, so the root's random shuffle only decides between equally ranked moves."""
+    pvMoveID = state.previousPV[ply].moveID if ply < len(state.previousPV) else 0
+    quietRank = quietRanker(ply, state)
+
+    def moveRank(move):
+        moveID = move.moveID
+        if moveID == hashMoveID:
+            return 3000000
+        if moveID == pvMoveID:
+            return 2000000
+        if move.pieceCaptured != EMPTY or move.isPawnPromotion:
+            return 1000000 + captureRank(move)
+        return quietRank(move)
+
+    moves.sort(key=moveRank, reverse=True)
+
+def quietRanker(ply, state):
+    """Sort key for the quiet moves at ply: the killer moves, then the rest by history."""
+    killer1, killer2 = state.killers[ply]
+    history = state.history
+
+    def quietRank(move):
+        moveID = move.moveID
+        if moveID == killer1:
+            return 900000
+        if moveID == killer2:
+            return 800000
+        return min(history[move.pieceMoved * 64 + move.endSq], 700000)
+
+    return quietRank
+
+def captureRank(move):
+    # most valuable victim first, then least valuable attacker; promotions count as winning the new piece
+    rank = pieceTypeValues[move.pieceCaptured & TYPE_MASK] * 100 - pieceTypeValues[move.pieceMoved & TYPE_MASK]
+    if move.isPawnPromotion:
+        rank += pieceTypeValues[move.promotionPiece] * 100
+    return rank
+
 def scoreBoard(gc):
     if gc.checkMate:
         if gc.whiteToMove:
@@ -106,31 +610,93 @@ def scoreBoard(gc):
             return CHECKMATE  # white wins
     elif gc.staleMate:
         return STALEMATE
+    return staticEvaluation(gc)
+
+def staticEvaluation(gc):
+    """Material and position score from white's point of view, ignoring mate and stalemate."""
+    score = gc.whiteScore - gc.blackScore
+    if DEBUG_EVAL:
+        # from the game's own tables, which setPieceSquareScores may have replaced
+        whiteScore, blackScore = gc.computeScores()
+        fullScore = whiteScore - blackScore
+        assert abs(score - fullScore) < 1e-6, f"incremental score {score} != full scan {fullScore}"
+    return score
+
+def scoreBoardFullScan(gc):
     score = 0
-    for row in range(len(gc.board)):
-        for col in range(len(gc.board[row])):
-            piece = gc.board[row][col]
-            if piece != "_":
-                piece_position_score = 0
-                # if piece.split("_")[1] != "king":
-                piece_position_score = piecePositionScores[piece][row][col]
-                if piece.split("_")[0] == "white":
-                    score += piece_score[piece.split("_")[1]] + piece_position_score
-                if piece.split("_")[0] == "black":
-                    score -= piece_score[piece.split("_")[1]] + piece_position_score
+    for sq, piece in enumerate(gc.squares):
+        if piece != EMPTY:
+            if piece & WHITE:
+                score += pieceSquareScores[piece][sq]
+            else:
+                score -= pieceSquareScores[piece][sq]
 
     return score
             
 
-def findBestMove(gc, validMoves, returnQueue):
-    # return validMoves[random.randint(0,len(validMoves) - 1)]
-    global nextMove
-    nextMove = None
+def findBestMove(gc, validMoves, returnQueue=None, timeLimit=TIME_LIMIT, nodeLimit=None, maxDepth=MAX_DEPTH,
+                 stopEvent=None, onIteration=None, table=None, startDepth=1, collectStats=None, statsOut=None,
+                 useBook=True):
+    """Iterative deepening: searches depth 1, 2, 3... until maxDepth or the time/node budget runs
+    out, or stopEvent is set, and returns a SearchResult for the deepest iteration that completed.
+    onIteration is called with the SearchResult of every completed iteration. When a returnQueue
+    is given the final result is also put on it. table replaces the module's transposition table
+    and startDepth the first iteration, for helper searches in a parallel search. With collectStats
+    (or SEARCH_STATS) the result carries SearchStats, and statsOut, a text file, gets them as one
+    JSON line per completed iteration. With useBook a move from the opening book is returned
+    straight away when there is one."""
+    if useBook and validMoves:
+        bookMove = probeBook(gc, validMoves)
+        if bookMove is not None:
+            result = SearchResult(bookMove, 0, 0, [bookMove], 0, 0.0, fromBook=True)
+            if returnQueue is not None:
+                returnQueue.put(result)
+            return result
+    if collectStats is None:
+        collectStats = SEARCH_STATS or statsOut is not None
+    stats = SearchStats() if collectStats else None
+    state = SearchState(timeLimit, nodeLimit, stopEvent, table, stats)
+    state.table.newSearch()
     random.shuffle(validMoves)
-    findMoveNegaMaxAlphaBeta(gc, validMoves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gc.whiteToMove else -1)
-    returnQueue.put(nextMove)
+    turn_multiplier = 1 if gc.whiteToMove else -1
+    # the search overwrites these while it looks at other positions
+    checkMate, staleMate, drawReason = gc.checkMate, gc.staleMate, gc.drawReason
+    startPly = len(gc.moveLog)
 
+    result = SearchResult(validMoves[0] if validMoves else None, 0, 0, [], 0, 0.0)
+    for depth in range(startDepth, maxDepth + 1):
+        if not validMoves:
+            break
+        state.rootDepth = depth
+        try:
+            score = findMoveNegaMaxAlphaBeta(gc, validMoves, depth, -CHECKMATE - 1, CHECKMATE + 1, turn_multiplier, state)
+        except SearchStopped:
+            while len(gc.moveLog) > startPly:
+                gc.undoMove()
+            break
+        state.previousPV = collectPV(gc, state.pvTable[0], depth, state.table)
+        result = SearchResult(state.previousPV[0], score, depth, state.previousPV, state.nodes,
+                              time.perf_counter() - state.startTime, state.qNodes, stats)
+        if stats is not None:
+            stats.depth, stats.nodes, stats.qNodes, stats.elapsed = depth, state.nodes, state.qNodes, result.elapsed
+            if statsOut is not None:
+                statsOut.write(stats.toJSON() + "\n")
+        if onIteration is not None:
+            onIteration(result)
+        if abs(score) >= CHECKMATE or (state.deadline is not None and time.perf_counter() >= state.deadline):
+            break
+    result.nodes = state.nodes
+    result.qNodes = state.qNodes
+    result.elapsed = time.perf_counter() - state.startTime
+    if stats is not None:
+        # the totals include the work of an iteration cut short, depth only counts completed ones
+        stats.nodes, stats.qNodes, stats.elapsed = state.nodes, state.qNodes, result.elapsed
+        result.stats = stats
 
+    gc.checkMate, gc.staleMate, gc.drawReason = checkMate, staleMate, drawReason
+    if returnQueue is not None:
+        returnQueue.put(result)
+    return result
 
 def randomMoveGenerator(validMoves):
     return validMoves[random.randint(0,len(validMoves) - 1)]
\ No newline at end of file
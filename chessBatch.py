@@ -0,0 +1,106 @@
+"""
+BATCHED EVALUATION WITH NUMPY - SCORES LARGE SETS OF POSITIONS IN ONE ARRAY OPERATION
+
+    python chessBatch.py --positions 50000
+
+The piece-square tables become one array with a plane of 64 scores per piece code (black's
+negated), so scoring N boards is a single gather and sum over an (N, 64) array of piece codes.
+This is for offline work such as scoring EPD files or tuning data; inside the search every game
+keeps running totals, which already make an evaluation one subtraction.
+"""
+import argparse
+import random
+import sys
+import time
+import numpy as np
+import chessAI
+from chessEngine import ChessGame, WHITE
+
+################################################################################
+#  BATCHED EVALUATION
+################################################################################
+def buildScoreArray(pieceSquareScores=None):
+    """A (piece codes, 64) float array of the given material plus position tables (chessAI's by
+    default), zero for unused codes and negated for black so a board's score is one sum."""
+    if pieceSquareScores is None:
+        pieceSquareScores = chessAI.pieceSquareScores
+    array = np.zeros((len(pieceSquareScores), 64))
+    for code, scores in enumerate(pieceSquareScores):
+        if scores is not None:
+            array[code] = scores if code & WHITE else np.negative(scores)
+    return array
+
+def boardArray(positions):
+    """(N, 64) array of piece codes from ChessGames, FEN strings or lists of 64 piece codes."""
+    boards = np.empty((len(positions), 64), dtype=np.uint8)
+    for i, position in enumerate(positions):
+        if isinstance(position, str):
+            position = ChessGame(position)
+        boards[i] = position.squares if isinstance(position, ChessGame) else position
+    return boards
+
+def evaluateBatch(positions, scoreArray=None):
+    """Static scores from white's point of view, the same as chessAI.staticEvaluation (and
+    scoreBoard for positions that are not mate or stalemate), as a float array. positions is
+    anything boardArray accepts, or an (N, 64) array of piece codes already."""
+    if scoreArray is None:
+        scoreArray = buildScoreArray()
+    boards = positions if isinstance(positions, np.ndarray) else boardArray(positions)
+    return scoreArray[boards, np.arange(64)].sum(axis=1)
+
+################################################################################
+#  BENCHMARK
+################################################################################
+def randomPositions(count, seed=0, maxPlies=80):
+    """Boards (lists of piece codes) from random playouts, a few taken from each game."""
+    rng = random.Random(seed)
+    boards = []
+    while len(boards) < count:
+        gc = ChessGame()
+        for ply in range(rng.randint(10, maxPlies)):
+            moves = gc.getAllLegalMoves()
+            if not moves or gc.staleMate:
+                break
+            gc.movePiece(rng.choice(moves))
+            if ply % 7 == 6:
+                boards.append(list(gc.squares))
+    return boards[:count]
+
+def benchmark(count, seed=0, out=sys.stdout):
+    """Times the scalar full-board evaluation against evaluateBatch on the same boards and checks
+    they agree. Returns the largest difference between the two."""
+    boards = randomPositions(count, seed)
+    scoreArray = buildScoreArray()
+    gc = ChessGame()
+
+    start = time.perf_counter()
+    scalar = []
+    for board in boards:
+        gc.squares = board
+        scalar.append(chessAI.scoreBoardFullScan(gc))
+    scalarTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    array = boardArray(boards)
+    convertTime = time.perf_counter() - start
+    start = time.perf_counter()
+    batch = evaluateBatch(array, scoreArray)
+    batchTime = time.perf_counter() - start
+
+    difference = float(np.max(np.abs(batch - np.array(scalar)))) if boards else 0.0
+    print(f"{len(boards)} positions", file=out)
+    print(f"scalar  {scalarTime:.3f}s  {len(boards) / scalarTime:>12.0f} positions/s", file=out)
+    print(f"batch   {batchTime:.3f}s  {len(boards) / batchTime:>12.0f} positions/s  "
+          f"(+{convertTime:.3f}s building the board array)", file=out)
+    print(f"largest difference {difference:.2e}", file=out)
+    return difference
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark batched NumPy evaluation against the scalar evaluation.")
+    parser.add_argument("--positions", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    return 0 if benchmark(args.positions, args.seed) < 1e-9 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""
+OPENING BOOK - INSTANT MOVES FOR KNOWN POSITIONS
+
+    python chessBook.py build games.pgn --out book.bin --plies 24
+    python chessBook.py probe book.bin --fen "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1"
+
+A book is a file of 16-byte entries sorted by position key, laid out like a Polyglot book (key,
+move, weight and learn fields, big-endian) but keyed by ChessGame.zobristKey and holding
+Move.moveID, so Polyglot books cannot be read as they are. The file is memory mapped and searched
+in place, so opening it costs nothing and every process using it shares the same pages.
+"""
+import argparse
+import mmap
+import random
+import re
+import struct
+import sys
+from chessEngine import ChessGame, START_FEN
+
+ENTRY = struct.Struct('>QHHI')  # key, move ID, weight, learn (unused, kept for the Polyglot layout)
+MAX_WEIGHT = 65535
+RESULT_TOKENS = ('1-0', '0-1', '1/2-1/2', '*')
+
+################################################################################
+#  READING BOOKS
+################################################################################
+class OpeningBook:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            size = file.seek(0, 2)
+            # an empty file cannot be mapped, and has nothing to find anyway
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.count = len(self.data) // ENTRY.size
+
+    def __len__(self):
+        return self.count
+
+    def find(self, key):
+        """Returns the (moveID, weight) pairs stored for a position key, by binary search."""
+        data = self.data
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if struct.unpack_from('>Q', data, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        while low < self.count:
+            entryKey, moveID, weight, learn = ENTRY.unpack_from(data, low * ENTRY.size)
+            if entryKey != key:
+                break
+            entries.append((moveID, weight))
+            low += 1
+        return entries
+
+    def probe(self, gc, moves=None, rng=random):
+        """Picks one of the book moves for gc's position at random, in proportion to the weights,
+        and returns it from moves (gc's legal moves by default). None when the position is not in
+        the book; entries that are not legal here (a key collision) are ignored."""
+        entries = self.find(gc.zobristKey)
+        if not entries:
+            return None
+        if moves is None:
+            moves = gc.getAllLegalMoves()
+        legal = {move.moveID: move for move in moves}
+        choices = [(legal[moveID], weight) for moveID, weight in entries if moveID in legal and weight > 0]
+        if not choices:
+            return None
+        pick = rng.uniform(0, sum(weight for move, weight in choices))
+        for move, weight in choices:
+            pick -= weight
+            if pick <= 0:
+                return move
+        return choices[-1][0]
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+################################################################################
+#  READING PGN
+################################################################################
+def readPGN(lines):
+    """Yields (headers, moves) for every game in an iterable of PGN lines, with the moves as SAN
+    strings. Comments, variations, move numbers and annotation glyphs are dropped."""
+    headers, movetext = {}, []
+    for line in lines:
+        line = line.strip()
+        if line.startswith('%'):
+            continue
+        if line.startswith('['):
+            if movetext:
+                yield headers, parseMovetext(' '.join(movetext))
+                headers, movetext = {}, []
+            match = re.match(r'\[(\w+)\s+"(.*)"\]', line)
+            if match:
+                headers[match.group(1)] = match.group(2)
+        elif line:
+            # a ';' comment runs to the end of its line
+            movetext.append(line.split(';')[0])
+    if movetext:
+        yield headers, parseMovetext(' '.join(movetext))
+
+def parseMovetext(text):
+    text = re.sub(r'\{[^}]*\}', ' ', text)
+    # strip variations from the innermost out
+    previous = None
+    while previous != text:
+        previous, text = text, re.sub(r'\([^()]*\)', ' ', text)
+    moves = []
+    for token in text.split():
+        token = re.sub(r'^\d+\.+', '', token)
+        if token and not token.startswith('$') and token not in RESULT_TOKENS:
+            moves.append(token)
+    return moves
+
+################################################################################
+#  BUILDING BOOKS
+################################################################################
+def gameWeights(result, whiteToMove):
+    """Weight a move gets from one game: 2 for the winner's moves, 1 for a draw or an unknown
+    result, nothing for the loser's."""
+    if result == '1-0':
+        return 2 if whiteToMove else 0
+    if result == '0-1':
+        return 0 if whiteToMove else 2
+    return 1
+
+def buildBook(games, maxPlies=24, minWeight=2, log=None):
+    """Collects the first maxPlies moves of every (headers, moves) game into a dict of position
+    key -> {moveID: weight}, keeping moves whose total weight is at least minWeight."""
+    positions = {}
+    for gameNumber, (headers, moves) in enumerate(games, 1):
+        try:
+            gc = ChessGame(headers.get('FEN', START_FEN))
+        except ValueError as error:
+            if log is not None:
+                print(f"game {gameNumber}: {error}", file=log)
+            continue
+        result = headers.get('Result', '*')
+        for san in moves[:maxPlies]:
+            move = gc.parseSAN(san)
+            if move is None:
+                if log is not None:
+                    print(f"game {gameNumber}: illegal move '{san}', rest of the game skipped", file=log)
+                break
+            weights = positions.setdefault(gc.zobristKey, {})
+            weights[move.moveID] = weights.get(move.moveID, 0) + gameWeights(result, gc.whiteToMove)
+            gc.movePiece(move)
+    for key in list(positions):
+        weights = {moveID: weight for moveID, weight in positions[key].items() if weight >= minWeight}
+        if weights:
+            positions[key] = weights
+        else:
+            del positions[key]
+    return positions
+
+def writeBook(positions, path):
+    """Writes the positions from buildBook as a book file. Returns the number of entries."""
+    count = 0
+    with open(path, 'wb') as out:
+        for key in sorted(positions):
+            # heaviest first, as Polyglot books order them
+            for moveID, weight in sorted(positions[key].items(), key=lambda item: -item[1]):
+                out.write(ENTRY.pack(key, moveID, min(weight, MAX_WEIGHT), 0))
+                count += 1
+    return count
+
+################################################################################
+#  COMMAND LINE
+################################################################################
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build opening books from PGN files, or look positions up in one.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="compile PGN games into a book")
+    build.add_argument("pgn", nargs="+", help="PGN files to read")
+    build.add_argument("--out", default="book.bin")
+    build.add_argument("--plies", type=int, default=24, help="moves taken from the start of every game")
+    build.add_argument("--min-weight", type=int, default=2,
+                       help="drop moves with less weight than this (2 per win, 1 per draw)")
+    probe = commands.add_parser("probe", help="list the book moves for a position")
+    probe.add_argument("book")
+    probe.add_argument("--fen", default=START_FEN)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        def games():
+            for path in args.pgn:
+                with open(path, errors="replace") as file:
+                    yield from readPGN(file)
+        positions = buildBook(games(), args.plies, args.min_weight, sys.stderr)
+        count = writeBook(positions, args.out)
+        print(f"{len(positions)} positions, {count} moves written to {args.out}", file=sys.stderr)
+    else:
+        book = OpeningBook(args.book)
+        gc = ChessGame(args.fen)
+        legal = {move.moveID: move for move in gc.getAllLegalMoves()}
+        for moveID, weight in book.find(gc.zobristKey):
+            if moveID in legal:
+                print(f"{gc.getSAN(legal[moveID]):>8} {legal[moveID].getNotation():>6} {weight:>6}")
+        book.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+BATCH ANALYSIS OF EPD FILES
+
+    python chessEPD.py positions.epd --time 1.0 --out results.jsonl
+    python chessEPD.py wac.epd --depth 6 --workers 4
+
+Every position is searched and one JSON line is written per position (best move, score, depth,
+nodes, timing and whether it matches the 'bm'/'am' operations). Positions are read, searched
+and written one at a time through generators, so memory use does not depend on the file size;
+with --workers only a small window of positions is in flight at once.
+"""
+import argparse
+import json
+import shlex
+import sys
+import time
+from collections import deque
+from multiprocessing import Pool
+from chessEngine import ChessGame
+import chessAI
+
+################################################################################
+#  READING EPD
+################################################################################
+class EPDRecord:
+    def __init__(self, lineNumber, fen, operations, error=None):
+        self.lineNumber = lineNumber
+        self.fen = fen
+        self.operations = operations  # opcode -> list of operands, e.g. {'bm': ['Nf3'], 'id': ['WAC.001']}
+        self.error = error  # why the line could not be parsed, in which case fen is the raw line
+
+    @property
+    def id(self):
+        return self.operations.get('id', [str(self.lineNumber)])[0]
+
+def parseEPD(line, lineNumber=0):
+    """Splits an EPD line into its position and operations. Returns None for blank lines and comments.
+    A full FEN (with move counters) is accepted as well."""
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError(f"line {lineNumber}: invalid EPD '{line}'")
+    rest = fields[4] if len(fields) > 4 else ''
+    fen = ' '.join(fields[:4])
+    # a FEN's move counters are two bare numbers where the operations would start
+    counters = rest.split(None, 2)
+    if len(counters) >= 2 and counters[0].isdigit() and counters[1].rstrip(';').isdigit():
+        fen += f" {counters[0]} {counters[1].rstrip(';')}"
+        rest = counters[2] if len(counters) > 2 else ''
+    operations = {}
+    for operation in rest.split(';'):
+        try:
+            tokens = shlex.split(operation)
+        except ValueError as error:
+            raise ValueError(f"line {lineNumber}: invalid EPD operation '{operation.strip()}' ({error})") from None
+        if tokens:
+            operations[tokens[0]] = tokens[1:]
+    return EPDRecord(lineNumber, fen, operations)
+
+def readEPD(lines):
+    """Yields an EPDRecord for every position in an iterable of lines, such as an open file. A line
+    that cannot be parsed gives a record with its error set, so one bad line does not end the run."""
+    for lineNumber, line in enumerate(lines, 1):
+        try:
+            record = parseEPD(line, lineNumber)
+        except ValueError as error:
+            record = EPDRecord(lineNumber, line.strip(), {}, str(error))
+        if record is not None:
+            yield record
+
+################################################################################
+#  ANALYSIS
+################################################################################
+class AnalysisSettings:
+    def __init__(self, timeLimit=None, maxDepth=chessAI.MAX_DEPTH, nodeLimit=None, ttSizeMB=chessAI.TT_SIZE_MB, collectStats=False,
+                 usePVS=True, useNullMove=True, useLMR=True):
+        self.timeLimit = timeLimit
+        self.maxDepth = maxDepth
+        self.nodeLimit = nodeLimit
+        self.ttSizeMB = ttSizeMB
+        self.collectStats = collectStats  # add the search's SearchStats to every result
+        self.usePVS = usePVS
+        self.useNullMove = useNullMove
+        self.useLMR = useLMR
+
+_table = None  # transposition table reused for every position searched in this process
+
+def analysePosition(record, settings):
+    """Searches one EPDRecord and returns its result as a JSON-ready dict."""
+    global _table
+    # set here rather than once in main, so pool workers that do not fork get them too
+    chessAI.USE_PVS, chessAI.USE_NULL_MOVE, chessAI.USE_LMR = settings.usePVS, settings.useNullMove, settings.useLMR
+    if _table is None or _table.size != chessAI.TranspositionTable.entriesFor(settings.ttSizeMB):
+        _table = chessAI.TranspositionTable(settings.ttSizeMB)
+    # positions in a test suite are unrelated, so nothing from the last one is worth keeping
+    _table.clear()
+    output = {"line": record.lineNumber, "id": record.id, "fen": record.fen}
+    if record.error is not None:
+        output["error"] = record.error
+        return output
+    try:
+        output.update(searchPosition(record, settings))
+    except ValueError as error:
+        output["error"] = str(error)
+    except Exception as error:
+        # a position the engine cannot cope with is reported, it must not end a run of thousands
+        output["error"] = f"{type(error).__name__}: {error}"
+    return output
+
+def searchPosition(record, settings):
+    """The search part of analysePosition: the fields describing the best move, or just "error"
+    for a position with no legal moves. Raises ValueError for a FEN that cannot be loaded."""
+    gc = ChessGame(record.fen)
+    validMoves = gc.getAllLegalMoves()
+    if not validMoves:
+        return {"error": "checkmate" if gc.checkMate else "stalemate"}
+
+    result = chessAI.findBestMove(gc, validMoves, timeLimit=settings.timeLimit, nodeLimit=settings.nodeLimit,
+                                  maxDepth=settings.maxDepth, table=_table, collectStats=settings.collectStats, useBook=False)
+    san = gc.getSAN(result.move)
+    output = {"move": result.move.getNotation(), "san": san, "score": round(result.score, 2),
+              "depth": result.depth, "nodes": result.nodes, "qnodes": result.qNodes,
+              "time": round(result.elapsed, 4), "pv": [move.getNotation() for move in result.pv]}
+    if result.stats is not None:
+        output["stats"] = result.stats.toDict()
+    # test suites give the expected moves in SAN, with or without the check marks
+    plain = san.rstrip('+#')
+    if 'bm' in record.operations:
+        output["solved"] = any(plain == expected.rstrip('+#') for expected in record.operations['bm'])
+    if 'am' in record.operations:
+        output["solved"] = output.get("solved", True) and all(plain != avoided.rstrip('+#') for avoided in record.operations['am'])
+    return output
+
+def _analyseTask(task):
+    return analysePosition(*task)
+
+def analyseStream(records, settings, workers=1):
+    """Yields a result for every record, in input order. With several workers the records are
+    spread over a process pool, but never more than a few per worker are read ahead."""
+    if workers <= 1:
+        for record in records:
+            yield analysePosition(record, settings)
+        return
+    with Pool(workers) as pool:
+        pending = deque()
+        for record in records:
+            pending.append(pool.apply_async(_analyseTask, ((record, settings),)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+def writeResults(results, out, log=None):
+    """Writes each result as a JSON line as soon as it arrives. Returns (positions, solved, tested)."""
+    positions = solved = tested = 0
+    start = time.perf_counter()
+    for result in results:
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+        positions += 1
+        if "solved" in result:
+            tested += 1
+            solved += result["solved"]
+        if log is not None:
+            elapsed = time.perf_counter() - start
+            status = "" if "solved" not in result else ("  ok" if result["solved"] else "  miss")
+            print(f"{positions:>6} {result['id']:>12}  {result.get('san', result.get('error', '')):>8}  "
+                  f"{positions / elapsed:.2f} positions/s{status}", file=log)
+    return positions, solved, tested
+
+################################################################################
+#  COMMAND LINE
+################################################################################
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search every position of an EPD file and write the results as JSON lines.")
+    parser.add_argument("epd", help="EPD file to read, or - for standard input")
+    parser.add_argument("--time", type=float, default=None, help="seconds per position")
+    parser.add_argument("--depth", type=int, default=None)
+    parser.add_argument("--nodes", type=int, default=None)
+    parser.add_argument("--tt", type=float, default=chessAI.TT_SIZE_MB, help="transposition table size in MB")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--out", default="-", help="JSON lines output file (default: standard output)")
+    parser.add_argument("--stats", action="store_true", help="include search statistics (cutoffs, TT hits, timings) in every result")
+    parser.add_argument("--no-pvs", action="store_true", help="search every move with the full window")
+    parser.add_argument("--no-null-move", action="store_true", help="turn off null-move pruning")
+    parser.add_argument("--no-lmr", action="store_true", help="turn off late move reductions")
+    parser.add_argument("--quiet", action="store_true", help="no progress lines on standard error")
+    args = parser.parse_args(argv)
+    if args.time is None and args.depth is None and args.nodes is None:
+        args.time = chessAI.TIME_LIMIT
+    settings = AnalysisSettings(args.time, args.depth or chessAI.MAX_DEPTH, args.nodes, args.tt, args.stats,
+                                not args.no_pvs, not args.no_null_move, not args.no_lmr)
+
+    source = sys.stdin if args.epd == '-' else open(args.epd)
+    out = sys.stdout if args.out == '-' else open(args.out, "w")
+    try:
+        positions, solved, tested = writeResults(analyseStream(readEPD(source), settings, args.workers), out,
+                                                 None if args.quiet else sys.stderr)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+    if tested and not args.quiet:
+        print(f"solved {solved}/{tested}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,116 +1,706 @@
 """
 HANDLES ALL INFORMATION ABOUT THE STATE OF THE GAME AND DETERMINING MOVES
 """
+import random
+
+################################################################################
+#  PIECE CODES
+################################################################################
+# squares hold small integers: the low three bits are the piece type and the
+# next two bits the colour, so colour and type are decoded with bit tests
+# instead of splitting 'white_knight' style strings
+EMPTY = 0
+PAWN = 1
+KNIGHT = 2
+BISHOP = 3
+ROOK = 4
+QUEEN = 5
+KING = 6
+TYPE_MASK = 7
+
+WHITE = 8
+BLACK = 16
+COLOR_MASK = 24
+
+PIECE_TYPES = {'pawn': PAWN, 'knight': KNIGHT, 'bishop': BISHOP, 'rook': ROOK, 'queen': QUEEN, 'king': KING}
+PIECE_COLORS = {'white': WHITE, 'black': BLACK}
+PIECE_NAMES = {color | piece: f'{colorName}_{pieceName}'
+               for colorName, color in PIECE_COLORS.items()
+               for pieceName, piece in PIECE_TYPES.items()}
+PIECE_NAMES[EMPTY] = '_'
+PIECE_CODES = {name: code for code, name in PIECE_NAMES.items()}
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+FEN_PIECES = {'P': WHITE | PAWN, 'N': WHITE | KNIGHT, 'B': WHITE | BISHOP, 'R': WHITE | ROOK, 'Q': WHITE | QUEEN, 'K': WHITE | KING,
+              'p': BLACK | PAWN, 'n': BLACK | KNIGHT, 'b': BLACK | BISHOP, 'r': BLACK | ROOK, 'q': BLACK | QUEEN, 'k': BLACK | KING}
+FEN_CHARS = {piece: char for char, piece in FEN_PIECES.items()}
+FILES = 'abcdefgh'
+SAN_PIECES = {KNIGHT: 'N', BISHOP: 'B', ROOK: 'R', QUEEN: 'Q', KING: 'K'}
+
+def squareName(row, col):
+    return FILES[col] + str(8 - row)
+
+def parseSquare(name):
+    """'e3' -> (row, col)"""
+    if len(name) != 2 or name[0] not in FILES or name[1] not in '12345678':
+        raise ValueError(f"invalid square '{name}'")
+    return 8 - int(name[1]), FILES.index(name[0])
+
+def fromStringBoard(board):
+    """Converts an 8x8 grid of 'white_knight' style strings to a flat list of 64 piece codes."""
+    return [PIECE_CODES[piece] for row in board for piece in row]
+
+def toStringBoard(squares):
+    """Converts a flat list of 64 piece codes back to the 8x8 grid of strings used for drawing."""
+    return [[PIECE_NAMES[squares[row * 8 + col]] for col in range(8)] for row in range(8)]
+
+PROMOTION_PIECES = (QUEEN, KNIGHT, ROOK, BISHOP)
+
+# castling rights are kept as one 4-bit mask
+WHITE_KINGSIDE = 1
+BLACK_KINGSIDE = 2
+WHITE_QUEENSIDE = 4
+BLACK_QUEENSIDE = 8
+ALL_CASTLING = 15
+# rights kept when a move starts or ends on each square: moving a king or rook, or capturing a
+# rook on its starting square, clears the rights that depend on it
+CASTLING_KEPT = [ALL_CASTLING] * 64
+CASTLING_KEPT[0] = ALL_CASTLING & ~BLACK_QUEENSIDE
+CASTLING_KEPT[4] = ALL_CASTLING & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_KEPT[7] = ALL_CASTLING & ~BLACK_KINGSIDE
+CASTLING_KEPT[56] = ALL_CASTLING & ~WHITE_QUEENSIDE
+CASTLING_KEPT[60] = ALL_CASTLING & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_KEPT[63] = ALL_CASTLING & ~WHITE_KINGSIDE
+
+ROOK_DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+BISHOP_DIRECTIONS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+KING_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+KNIGHT_DIRECTIONS = ((2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2))
+
+################################################################################
+#  ATTACK LOOKUPS
+################################################################################
+def _leaperTargets(sq, directions):
+    row, col = sq >> 3, sq & 7
+    return tuple((row + dr) * 8 + col + dc for dr, dc in directions if 0 <= row + dr < 8 and 0 <= col + dc < 8)
+
+def _ray(sq, dr, dc):
+    row, col = (sq >> 3) + dr, (sq & 7) + dc
+    ray = []
+    while 0 <= row < 8 and 0 <= col < 8:
+        ray.append(row * 8 + col)
+        row += dr
+        col += dc
+    return tuple(ray)
+
+KNIGHT_TARGETS = [_leaperTargets(sq, KNIGHT_DIRECTIONS) for sq in range(64)]
+KING_TARGETS = [_leaperTargets(sq, KING_DIRECTIONS) for sq in range(64)]
+# squares a pawn of the given colour must stand on to attack sq
+PAWN_ATTACKERS = {WHITE: [_leaperTargets(sq, ((1, -1), (1, 1))) for sq in range(64)],
+                  BLACK: [_leaperTargets(sq, ((-1, -1), (-1, 1))) for sq in range(64)]}
+# rays from every square, rook directions first then bishop directions (same order as KING_DIRECTIONS)
+RAYS = [tuple(_ray(sq, dr, dc) for dr, dc in KING_DIRECTIONS) for sq in range(64)]
+ROOK_RAYS = [rays[:4] for rays in RAYS]
+BISHOP_RAYS = [rays[4:] for rays in RAYS]
+
+################################################################################
+#  ZOBRIST KEYS
+################################################################################
+# fixed seed so every process (search workers, books, saved tables) agrees on the keys
+_zobristRandom = random.Random(0x5EED)
+ZOBRIST_PIECES = [[_zobristRandom.getrandbits(64) for sq in range(64)] if code in PIECE_NAMES and code != EMPTY else None
+                  for code in range(max(PIECE_NAMES) + 1)]
+ZOBRIST_BLACK_TO_MOVE = _zobristRandom.getrandbits(64)
+ZOBRIST_CASTLING = [_zobristRandom.getrandbits(64) for rights in range(16)]  # indexed by ChessGame.castlingRights
+ZOBRIST_EN_PASSANT = [_zobristRandom.getrandbits(64) for col in range(8)]    # indexed by en passant file
 
 ################################################################################
 #  GAME CLASS
 ################################################################################
 class ChessGame:
-    def __init__(self):
-        # CHANGE THIS TO A NUMPY ARRAY LATER ON FOR FASTER DATA HANDLING
-        self.board = [
-            ['black_rook', 'black_knight', 'black_bishop', 'black_queen', 'black_king', 'black_bishop', 'black_knight', 'black_rook'],
-            ['black_pawn'] * 8,
-            ['_'] * 8,
-            ['_'] * 8,
-            ['_'] * 8,
-            ['_'] * 8,
-            ['white_pawn'] * 8,
-            ['white_rook', 'white_knight', 'white_bishop', 'white_queen', 'white_king', 'white_bishop', 'white_knight', 'white_rook']
-        ]
-        self.whiteToMove = True
-        self.whiteKingLocation = (7, 4)
-        self.blackKingLocation = (0, 4)
+    # set to True to filter pseudo-legal moves with make/undo and full move generation attack
+    # tests, the way the engine used to - kept to compare against the pin/check aware generator
+    legacyMoveGen = False
+    # material plus position score of every piece code on every square, indexed [piece][sq];
+    # chessAI installs its tables here so the running totals below match its evaluation
+    pieceSquareScores = [[0.0] * 64 for code in range(max(PIECE_NAMES) + 1)]
+
+    def __init__(self, fen=START_FEN):
+        self.moveFunctions = {PAWN: self.getPawnMoves, ROOK: self.getRookMoves, KNIGHT: self.getKnightMoves, 
+                              BISHOP: self.getBishopMoves, QUEEN: self.getQueenMoves, KING: self.getKingMoves}
+        self.loadFEN(fen)
+
+    def loadFEN(self, fen):
+        """Sets up the position described by a FEN string (piece placement, side to move, castling
+        rights, en passant square and move counters) and clears the move history. The counters
+        may be left off, as in EPD."""
+        fields = fen.split()
+        if len(fields) < 2:
+            raise ValueError(f"invalid FEN '{fen}'")
+        ranks = fields[0].split('/')
+        if len(ranks) != 8:
+            raise ValueError(f"invalid board in FEN '{fen}'")
+        squares = []
+        for rank in ranks:
+            rankSquares = []
+            for char in rank:
+                if char in '12345678':
+                    rankSquares.extend([EMPTY] * int(char))
+                elif char in FEN_PIECES:
+                    rankSquares.append(FEN_PIECES[char])
+                else:
+                    raise ValueError(f"invalid piece '{char}' in FEN '{fen}'")
+            # two digits in a row ('44') add up but are not how a FEN writes empty squares
+            if len(rankSquares) != 8 or any(a.isdigit() and b.isdigit() for a, b in zip(rank, rank[1:])):
+                raise ValueError(f"rank '{rank}' is not 8 squares in FEN '{fen}'")
+            squares += rankSquares
+        if squares.count(WHITE | KING) != 1 or squares.count(BLACK | KING) != 1:
+            raise ValueError(f"invalid board in FEN '{fen}'")
+        if any(piece & TYPE_MASK == PAWN for piece in squares[:8] + squares[56:]):
+            raise ValueError(f"pawn on the first or last rank in FEN '{fen}'")
+        if fields[1] not in ('w', 'b'):
+            raise ValueError(f"invalid side to move in FEN '{fen}'")
+        castling = fields[2] if len(fields) > 2 else '-'
+        if castling != '-' and (not castling or any(char not in 'KQkq' for char in castling)):
+            raise ValueError(f"invalid castling rights in FEN '{fen}'")
+        enpassant = fields[3] if len(fields) > 3 else '-'
+        if enpassant != '-' and (len(enpassant) != 2 or enpassant[0] not in FILES or enpassant[1] not in '36'):
+            raise ValueError(f"invalid en passant square in FEN '{fen}'")
+        try:
+            halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+            fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError(f"invalid move counters in FEN '{fen}'") from None
+        if halfmoveClock < 0 or fullmoveNumber < 0:
+            raise ValueError(f"invalid move counters in FEN '{fen}'")
+
+        # flat 64-entry board indexed by row * 8 + col, row 0 being black's back rank
+        self.squares = squares
+        self.whiteToMove = fields[1] == 'w'
+        whiteKing, blackKing = squares.index(WHITE | KING), squares.index(BLACK | KING)
+        self.whiteKingLocation = (whiteKing >> 3, whiteKing & 7)
+        self.blackKingLocation = (blackKing >> 3, blackKing & 7)
+        # the side that just moved cannot have left its own king in check
+        if self.isSquareAttacked(blackKing if self.whiteToMove else whiteKing, WHITE if self.whiteToMove else BLACK):
+            raise ValueError(f"side not to move is in check in FEN '{fen}'")
 
         self.checkMate = False
         self.staleMate = False
+        self.drawReason = None
         
-        self.enpassantPossible = ()
-        self.castleRights = CanCastle(True, True, True, True)
-        self.castleRightLog = [CanCastle(self.castleRights.wks, self.castleRights.bks, self.castleRights.wqs, self.castleRights.bqs)]
+        self.enpassantSq = -1  # square a pawn can capture en passant on, -1 for none
+        if enpassant != '-':
+            row, col = parseSquare(enpassant)
+            sq = row * 8 + col
+            # only kept if the pawn that just moved two squares is there and the squares it crossed are empty
+            pawn, ahead = (BLACK | PAWN, 8) if self.whiteToMove else (WHITE | PAWN, -8)
+            if row == (2 if self.whiteToMove else 5) and squares[sq + ahead] == pawn \
+                    and squares[sq] == EMPTY and squares[sq - ahead] == EMPTY:
+                self.enpassantSq = sq
+        self.castlingRights = 0
+        # a right is dropped when its king or rook is not on its home square, as nothing could castle with it
+        for char, right, kingSq, rookSq, color in (('K', WHITE_KINGSIDE, 60, 63, WHITE), ('Q', WHITE_QUEENSIDE, 60, 56, WHITE),
+                                                   ('k', BLACK_KINGSIDE, 4, 7, BLACK), ('q', BLACK_QUEENSIDE, 4, 0, BLACK)):
+            if char in castling and squares[kingSq] == color | KING and squares[rookSq] == color | ROOK:
+                self.castlingRights |= right
+        self.halfmoveClock = halfmoveClock    # plies since the last capture or pawn move
+        self.fullmoveNumber = max(fullmoveNumber, 1)
         
+        self.startFEN = fen  # moveLog is played from here
         self.moveLog = []
-        self.moveFunctions = {'pawn': self.getPawnMoves, 'rook': self.getRookMoves, 'knight': self.getKnightMoves, 
-                              'bishop': self.getBishopMoves, 'queen': self.getQueenMoves, 'king': self.getKingMoves}
+        self.zobristKey = self.computeZobristKey()
+        self.whiteScore, self.blackScore = self.computeScores()
+        self.pieceCounts = [0] * (max(PIECE_NAMES) + 1)  # pieces of each code on the board
+        for piece in squares:
+            if piece != EMPTY:
+                self.pieceCounts[piece] += 1
+        # one entry per move in moveLog holding what undoMove cannot work out from the move itself:
+        # (castling rights | (en passant square + 1) << 4 | halfmove clock << 11, zobrist key, white score, black score)
+        self.undoLog = []
+
+    def getFEN(self):
+        """FEN string of the current position, the inverse of loadFEN."""
+        rows = []
+        for row in range(8):
+            text, empty = '', 0
+            for piece in self.squares[row * 8:row * 8 + 8]:
+                if piece == EMPTY:
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                text += FEN_CHARS[piece]
+            rows.append(text + (str(empty) if empty else ''))
+        rights = self.castlingRights
+        castling = (('K' if rights & WHITE_KINGSIDE else '') + ('Q' if rights & WHITE_QUEENSIDE else '') +
+                    ('k' if rights & BLACK_KINGSIDE else '') + ('q' if rights & BLACK_QUEENSIDE else ''))
+        enpassant = squareName(self.enpassantSq >> 3, self.enpassantSq & 7) if self.enpassantSq >= 0 else '-'
+        return f"{'/'.join(rows)} {'w' if self.whiteToMove else 'b'} {castling or '-'} {enpassant} {self.halfmoveClock} {self.fullmoveNumber}"
+
+    def setPieceSquareScores(self, pieceSquareScores):
+        """Evaluates this game with its own table instead of the one installed on the class."""
+        self.pieceSquareScores = pieceSquareScores
+        self.whiteScore, self.blackScore = self.computeScores()
+
+    def getSAN(self, move):
+        """Standard algebraic notation for a legal move in the current position, e.g. 'Nbd7', 'exd6', 'e8=Q+'."""
+        if move.isCastleMove:
+            san = 'O-O' if move.endcol > move.startcol else 'O-O-O'
+        else:
+            pieceType = move.pieceMoved & TYPE_MASK
+            target = squareName(move.endrow, move.endcol)
+            capture = 'x' if move.pieceCaptured != EMPTY else ''
+            if pieceType == PAWN:
+                san = (FILES[move.startcol] + capture if capture else '') + target
+                if move.isPawnPromotion:
+                    san += '=' + SAN_PIECES[move.promotionPiece]
+            else:
+                checkMate, staleMate = self.checkMate, self.staleMate
+                # other pieces of the same kind that could also reach the target square
+                rivals = [other for other in self.getAllLegalMoves()
+                          if other.pieceMoved == move.pieceMoved and other.endSq == move.endSq and other.startSq != move.startSq]
+                self.checkMate, self.staleMate = checkMate, staleMate
+                disambiguation = ''
+                if rivals:
+                    if all(other.startcol != move.startcol for other in rivals):
+                        disambiguation = FILES[move.startcol]
+                    elif all(other.startrow != move.startrow for other in rivals):
+                        disambiguation = str(8 - move.startrow)
+                    else:
+                        disambiguation = squareName(move.startrow, move.startcol)
+                san = SAN_PIECES[pieceType] + disambiguation + capture + target
+        checkMate, staleMate = self.checkMate, self.staleMate
+        self.movePiece(move)
+        if self.inCheck():
+            san += '#' if len(self.getLegalMoves()) == 0 else '+'
+        self.undoMove()
+        self.checkMate, self.staleMate = checkMate, staleMate
+        return san
+
+    def parseSAN(self, san):
+        """Returns the legal move matching standard algebraic notation such as 'Nf3', 'exd6' or 'e8=Q+',
+        or None. Check marks and annotations are ignored, and '0-0' and 'e8Q' are accepted as well."""
+        san = san.rstrip('+#!?').replace('0', 'O')
+        if len(san) > 2 and san[0] in FILES and san[-1] in 'QRBN' and san[-2] != '=':
+            san = san[:-1] + '=' + san[-1]
+        target = san.split('=')[0][-2:]
+        castling = san in ('O-O', 'O-O-O')
+        for move in self.getAllLegalMoves():
+            # only moves to the right square are worth writing out in full
+            if (move.isCastleMove if castling else squareName(move.endrow, move.endcol) == target):
+                if self.getSAN(move).rstrip('+#') == san:
+                    return move
+        return None
+
+    def parseMove(self, notation):
+        """Returns the legal move matching coordinate notation such as 'e2e4' or 'e7e8q', or None."""
+        for move in self.getAllLegalMoves():
+            if move.getNotation() == notation:
+                return move
+        return None
+
+    @property
+    def board(self):
+        # string grid view of the position, rebuilt on every access - only meant for drawing
+        return toStringBoard(self.squares)
     
+    def computeZobristKey(self):
+        """Builds the position key from scratch; movePiece and undoMove keep it up to date incrementally."""
+        key = 0
+        for sq, piece in enumerate(self.squares):
+            if piece != EMPTY:
+                key ^= ZOBRIST_PIECES[piece][sq]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING[self.castlingRights]
+        if self.enpassantSq >= 0:
+            key ^= ZOBRIST_EN_PASSANT[self.enpassantSq & 7]
+        return key
+
+    def computeScores(self):
+        """Sums pieceSquareScores over the board for each side; movePiece and undoMove keep the totals up to date."""
+        whiteScore = blackScore = 0.0
+        for sq, piece in enumerate(self.squares):
+            if piece & WHITE:
+                whiteScore += self.pieceSquareScores[piece][sq]
+            elif piece & BLACK:
+                blackScore += self.pieceSquareScores[piece][sq]
+        return whiteScore, blackScore
+
     def isValidPosition(self, row, col):
         return 0 <= row < 8 and 0 <= col < 8
         
     def movePiece(self, move):
-        self.board[move.startrow][move.startcol] = '_'
-        self.board[move.endrow][move.endcol] = move.pieceMoved
+        board = self.squares
+        table = self.pieceSquareScores
+        key = self.zobristKey
+        rights = self.castlingRights
+        self.undoLog.append((rights | (self.enpassantSq + 1) << 4 | self.halfmoveClock << 11, key, self.whiteScore, self.blackScore))
+        # score change for the side moving and for the side being captured from
+        moverDelta = table[move.pieceMoved][move.endSq] - table[move.pieceMoved][move.startSq]
+        capturedDelta = 0.0
+        key ^= ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_CASTLING[rights]
+        if self.enpassantSq >= 0:
+            key ^= ZOBRIST_EN_PASSANT[self.enpassantSq & 7]
+
+        board[move.startSq] = EMPTY
+        board[move.endSq] = move.pieceMoved
+        key ^= ZOBRIST_PIECES[move.pieceMoved][move.startSq] ^ ZOBRIST_PIECES[move.pieceMoved][move.endSq]
+        if move.pieceCaptured != EMPTY:
+            self.pieceCounts[move.pieceCaptured] -= 1
+            if not move.isEnPassant:
+                key ^= ZOBRIST_PIECES[move.pieceCaptured][move.endSq]
+                capturedDelta = table[move.pieceCaptured][move.endSq]
         self.moveLog.append(move)
         self.whiteToMove = not self.whiteToMove
+        if move.pieceMoved & TYPE_MASK == PAWN or move.pieceCaptured != EMPTY:
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        if self.whiteToMove:
+            self.fullmoveNumber += 1
         
-        if move.pieceMoved == 'white_king':
-            self.whiteKingLocation = (move.endrow, move.endcol)
-        if move.pieceMoved == 'black_king':
-            self.blackKingLocation = (move.endrow, move.endcol)
+        if move.pieceMoved == WHITE | KING:
+            self.whiteKingLocation = (move.endSq >> 3, move.endSq & 7)
+        if move.pieceMoved == BLACK | KING:
+            self.blackKingLocation = (move.endSq >> 3, move.endSq & 7)
             
         if move.isPawnPromotion:
-            self.board[move.endrow][move.endcol] = move.pieceMoved.split("_")[0] + "_queen"
+            promotedPiece = (move.pieceMoved & COLOR_MASK) | move.promotionPiece
+            board[move.endSq] = promotedPiece
+            self.pieceCounts[move.pieceMoved] -= 1
+            self.pieceCounts[promotedPiece] += 1
+            key ^= ZOBRIST_PIECES[move.pieceMoved][move.endSq] ^ ZOBRIST_PIECES[promotedPiece][move.endSq]
+            moverDelta += table[promotedPiece][move.endSq] - table[move.pieceMoved][move.endSq]
             
         if move.isEnPassant:
-            self.board[move.startrow][move.endcol] = '_'
+            capturedSq = (move.startSq & ~7) | (move.endSq & 7)  # beside the pawn, on the rank it started on
+            board[capturedSq] = EMPTY
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][capturedSq]
+            capturedDelta = table[move.pieceCaptured][capturedSq]
         
-        if move.pieceMoved.split("_")[1] == 'pawn' and abs(move.startrow - move.endrow) == 2:
-            self.enpassantPossible = ((move.startrow + move.endrow) // 2, move.startcol)
+        if move.pieceMoved & TYPE_MASK == PAWN and abs(move.startSq - move.endSq) == 16:
+            self.enpassantSq = (move.startSq + move.endSq) >> 1
+            key ^= ZOBRIST_EN_PASSANT[move.startSq & 7]
         else:
-            self.enpassantPossible = ()
+            self.enpassantSq = -1
             
         if move.isCastleMove:
-            if move.endcol - move.startcol == 2:  # king-side castle move
-                self.board[move.endrow][move.endcol - 1] = self.board[move.endrow][move.endcol + 1]
-                self.board[move.endrow][move.endcol + 1] = '_'
+            if move.endSq - move.startSq == 2:  # king-side castle move
+                rookFrom, rookTo = move.endSq + 1, move.endSq - 1
             else:
-                self.board[move.endrow][move.endcol + 1] = self.board[move.endrow][move.endcol - 2]
-                self.board[move.endrow][move.endcol - 2] = '_'
+                rookFrom, rookTo = move.endSq - 2, move.endSq + 1
+            rook = board[rookFrom]
+            board[rookTo] = rook
+            board[rookFrom] = EMPTY
+            key ^= ZOBRIST_PIECES[rook][rookFrom] ^ ZOBRIST_PIECES[rook][rookTo]
+            moverDelta += table[rook][rookTo] - table[rook][rookFrom]
 
-            
-        self.updateCastlingRights(move)
-        self.castleRightLog.append(CanCastle(self.castleRights.wks, self.castleRights.bks, self.castleRights.wqs, self.castleRights.bqs))
+        if move.pieceMoved & WHITE:
+            self.whiteScore += moverDelta
+            self.blackScore -= capturedDelta
+        else:
+            self.blackScore += moverDelta
+            self.whiteScore -= capturedDelta
+
+        rights &= CASTLING_KEPT[move.startSq] & CASTLING_KEPT[move.endSq]
+        self.castlingRights = rights
+        self.zobristKey = key ^ ZOBRIST_CASTLING[rights]
           
+    def makeNullMove(self):
+        """Passes the turn without moving, for null-move pruning in the search. It goes on moveLog
+        as None and undoMove takes it back like any other move."""
+        self.undoLog.append((self.castlingRights | (self.enpassantSq + 1) << 4 | self.halfmoveClock << 11,
+                             self.zobristKey, self.whiteScore, self.blackScore))
+        self.zobristKey ^= ZOBRIST_BLACK_TO_MOVE
+        if self.enpassantSq >= 0:
+            self.zobristKey ^= ZOBRIST_EN_PASSANT[self.enpassantSq & 7]
+            self.enpassantSq = -1
+        # no position from before the pass may count as a repetition of one after it
+        self.halfmoveClock = 0
+        self.moveLog.append(None)
+        self.whiteToMove = not self.whiteToMove
+
     def undoMove(self):
         if len(self.moveLog) != 0:
+            board = self.squares
             moveToUndo = self.moveLog.pop()
-            self.board[moveToUndo.startrow][moveToUndo.startcol] = moveToUndo.pieceMoved
-            self.board[moveToUndo.endrow][moveToUndo.endcol] = moveToUndo.pieceCaptured
             self.whiteToMove = not self.whiteToMove
+            state, self.zobristKey, self.whiteScore, self.blackScore = self.undoLog.pop()
+            self.castlingRights = state & 15
+            self.enpassantSq = ((state >> 4) & 127) - 1
+            self.halfmoveClock = state >> 11
+            if moveToUndo is None:  # null move
+                return
+            board[moveToUndo.startSq] = moveToUndo.pieceMoved
+            board[moveToUndo.endSq] = moveToUndo.pieceCaptured
+            if not self.whiteToMove:
+                self.fullmoveNumber -= 1
+            if moveToUndo.pieceCaptured != EMPTY:
+                self.pieceCounts[moveToUndo.pieceCaptured] += 1
+            if moveToUndo.isPawnPromotion:
+                self.pieceCounts[moveToUndo.pieceMoved] += 1
+                self.pieceCounts[(moveToUndo.pieceMoved & COLOR_MASK) | moveToUndo.promotionPiece] -= 1
             
-            if moveToUndo.pieceMoved == 'white_king':
-                self.whiteKingLocation = (moveToUndo.startrow, moveToUndo.startcol)
-            if moveToUndo.pieceMoved == 'black_king':
-                self.blackKingLocation = (moveToUndo.startrow, moveToUndo.startcol)
+            if moveToUndo.pieceMoved == WHITE | KING:
+                self.whiteKingLocation = (moveToUndo.startSq >> 3, moveToUndo.startSq & 7)
+            if moveToUndo.pieceMoved == BLACK | KING:
+                self.blackKingLocation = (moveToUndo.startSq >> 3, moveToUndo.startSq & 7)
                 
             if moveToUndo.isEnPassant:
-                self.board[moveToUndo.endrow][moveToUndo.endcol] = "_"
-                self.board[moveToUndo.startrow][moveToUndo.endcol] = moveToUndo.pieceCaptured
-                self.enpassantPossible = (moveToUndo.endrow, moveToUndo.endcol)
-            
-            if moveToUndo.pieceMoved.split("_")[0] == 'pawn' and abs(moveToUndo.startrow - moveToUndo.endrow) == 2:
-                self.enpassantPossible = ()
-                
-            self.castleRightLog.pop()
-            newRights = self.castleRightLog[-1]
-            self.castleRights = CanCastle(newRights.wks, newRights.bks, newRights.wqs, newRights.bqs)
-                        
+                board[moveToUndo.endSq] = EMPTY
+                board[(moveToUndo.startSq & ~7) | (moveToUndo.endSq & 7)] = moveToUndo.pieceCaptured
+
             if moveToUndo.isCastleMove:
-                if moveToUndo.endcol - moveToUndo.startcol == 2:  # king-side
-                    self.board[moveToUndo.endrow][moveToUndo.endcol + 1] = self.board[moveToUndo.endrow][moveToUndo.endcol - 1]
-                    self.board[moveToUndo.endrow][moveToUndo.endcol - 1] = '_'
+                if moveToUndo.endSq - moveToUndo.startSq == 2:  # king-side
+                    board[moveToUndo.endSq + 1] = board[moveToUndo.endSq - 1]
+                    board[moveToUndo.endSq - 1] = EMPTY
                 else:  # queen-side
-                    self.board[moveToUndo.endrow][moveToUndo.endcol - 2] = self.board[moveToUndo.endrow][moveToUndo.endcol + 1]
-                    self.board[moveToUndo.endrow][moveToUndo.endcol + 1] = '_'
+                    board[moveToUndo.endSq - 2] = board[moveToUndo.endSq + 1]
+                    board[moveToUndo.endSq + 1] = EMPTY
                                       
     def getAllLegalMoves(self):
-        tempEnPassantPossible = self.enpassantPossible
-        tempCastleRights = CanCastle(self.castleRights.wks, self.castleRights.bks, self.castleRights.wqs, self.castleRights.bqs)
+        if self.legacyMoveGen:
+            moves = self.getLegalMovesByFiltering()
+        else:
+            moves = self.getLegalMoves()
+        
+        # staleMate also marks the game drawn by rule, with drawReason saying which one
+        self.drawReason = None
+        if len(moves) == 0: # either checkmate or stalemate
+            if self.inCheck():
+                self.checkMate = True
+            else:
+                self.drawReason = 'stalemate'
+            self.staleMate = True
+        else:
+            self.checkMate = False
+            self.staleMate = False
+            if self.hasInsufficientMaterial():
+                self.drawReason = 'insufficient material'
+            elif self.halfmoveClock >= 100:
+                self.drawReason = 'fifty-move rule'
+            elif self.repetitionCount() >= 3:
+                self.drawReason = 'threefold repetition'
+            self.staleMate = self.drawReason is not None
+        
+        return moves
+
+    def hasPieces(self, color):
+        """True if color has anything besides pawns and the king."""
+        counts = self.pieceCounts
+        return counts[color | KNIGHT] + counts[color | BISHOP] + counts[color | ROOK] + counts[color | QUEEN] > 0
+
+    def hasInsufficientMaterial(self):
+        """True when neither side has mating material: bare kings, or one knight or bishop in total."""
+        counts = self.pieceCounts
+        for piece in (PAWN, ROOK, QUEEN):
+            if counts[WHITE | piece] or counts[BLACK | piece]:
+                return False
+        return counts[WHITE | KNIGHT] + counts[WHITE | BISHOP] + counts[BLACK | KNIGHT] + counts[BLACK | BISHOP] <= 1
+
+    def repetitionCount(self):
+        """How many times the current position has occurred in the game, this time included. Only
+        positions since the last capture or pawn move, with the same side to move, can match."""
+        key = self.zobristKey
+        undoLog = self.undoLog
+        count = 1
+        # undoLog[i] holds the key of the position before move i was played
+        for i in range(len(undoLog) - 2, max(len(undoLog) - self.halfmoveClock, 0) - 1, -2):
+            if undoLog[i][1] == key:
+                count += 1
+        return count
+
+    def isRepetition(self):
+        """True if the current position occurred before - the search scores the first repeat as a draw."""
+        key = self.zobristKey
+        undoLog = self.undoLog
+        for i in range(len(undoLog) - 4, max(len(undoLog) - self.halfmoveClock, 0) - 1, -2):
+            if undoLog[i][1] == key:
+                return True
+        return False
+
+    def getCaptureMoves(self):
+        """Legal captures and promotions only, for the quiescence search. Unlike getAllLegalMoves
+        it leaves checkMate and staleMate alone, since an empty list says nothing about either."""
+        return self.getLegalMoves(capturesOnly=True)
+
+    def findChecksAndPins(self):
+        """Looks outwards from the side to move's king once. Returns (kingSq, them, checkers,
+        checkMask, pinRays): checkMask is the squares a non-king move must land on to answer a
+        single check (None when not in check), pinRays maps each pinned square to the squares its
+        piece may move to without exposing the king."""
+        board = self.squares
+        us = WHITE if self.whiteToMove else BLACK
+        them = BLACK if self.whiteToMove else WHITE
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        kingSq = kingRow * 8 + kingCol
+
+        checkers = 0
+        checkMask = None  # squares a non-king move must land on to answer a single check
+        pinRays = {}      # pinned square -> squares it may move to without exposing the king
+        for sq in KNIGHT_TARGETS[kingSq]:
+            if board[sq] == them | KNIGHT:
+                checkers += 1
+                checkMask = (sq,)
+        for sq in PAWN_ATTACKERS[them][kingSq]:
+            if board[sq] == them | PAWN:
+                checkers += 1
+                checkMask = (sq,)
+        for direction, ray in enumerate(RAYS[kingSq]):
+            slider = ROOK if direction < 4 else BISHOP
+            pinned = -1
+            for i, sq in enumerate(ray):
+                piece = board[sq]
+                if piece == EMPTY:
+                    continue
+                if piece & us:
+                    if pinned < 0:
+                        pinned = sq
+                        continue
+                    break
+                if piece & TYPE_MASK == slider or piece & TYPE_MASK == QUEEN:
+                    if pinned < 0:
+                        checkers += 1
+                        checkMask = ray[:i + 1]
+                    else:
+                        pinRays[pinned] = ray[:i + 1]
+                break
+        return kingSq, them, checkers, checkMask, pinRays
+
+    def getLegalMoves(self, capturesOnly=False):
+        """Generates legal moves directly: checkers and pinned pieces are found once by looking
+        outwards from the king, then each pseudo-legal move is accepted or rejected without
+        making it."""
+        board = self.squares
+        us = WHITE if self.whiteToMove else BLACK
+        kingSq, them, checkers, checkMask, pinRays = self.findChecksAndPins()
+
+        pseudoMoves = []
+        if checkers > 1:  # double check, only the king can move
+            self.getKingMoves(kingSq, pseudoMoves)
+            if capturesOnly:
+                pseudoMoves = [move for move in pseudoMoves if move.pieceCaptured != EMPTY]
+        elif capturesOnly:
+            pseudoMoves = self.getEveryCapture()
+        else:
+            pseudoMoves = self.getEveryMove()
+            if checkers == 0:
+                self.getCastleMoves(kingSq, pseudoMoves)
+
+        moves = []
+        board[kingSq] = EMPTY  # so squares behind the king along a checking ray count as attacked
+        for move in pseudoMoves:
+            if move.startSq == kingSq:
+                if move.isCastleMove or not self.isSquareAttacked(move.endSq, them):
+                    moves.append(move)
+            elif move.isEnPassant:
+                board[kingSq] = us | KING
+                if self.enPassantIsLegal(move, kingSq, them):
+                    moves.append(move)
+                board[kingSq] = EMPTY
+            elif checkMask is not None and move.endSq not in checkMask:
+                continue
+            elif move.startSq in pinRays and move.endSq not in pinRays[move.startSq]:
+                continue
+            else:
+                moves.append(move)
+        board[kingSq] = us | KING
+        return moves
+
+    def isLegalMove(self, move, kingSq, them, checkMask, pinRays):
+        """getLegalMoves' test for a single pseudo-legal move, given findChecksAndPins' results."""
+        if move.startSq == kingSq:
+            if move.isCastleMove:
+                return True  # getCastleMoves already checked the squares the king crosses
+            board = self.squares
+            board[kingSq] = EMPTY
+            legal = not self.isSquareAttacked(move.endSq, them)
+            board[kingSq] = move.pieceMoved
+            return legal
+        if move.isEnPassant:
+            return self.enPassantIsLegal(move, kingSq, them)
+        if checkMask is not None and move.endSq not in checkMask:
+            return False
+        pinRay = pinRays.get(move.startSq)
+        return pinRay is None or move.endSq in pinRay
+
+    def generateMoves(self, hashMoveID=0, captureKey=None, quietKey=None):
+        """Staged legal move generator for the search: the hash move, then captures and promotions,
+        then quiet moves, each stage generated only when the one before it is used up and each
+        move checked for legality only when its turn comes, so a node that cuts off early never
+        generates its quiet moves. captureKey and quietKey sort their stages, best first. Every
+        move must be taken back before the next one is asked for."""
+        kingSq, them, checkers, checkMask, pinRays = self.findChecksAndPins()
+        if hashMoveID:
+            hashMove = self.findPseudoMove(hashMoveID, checkers == 0)
+            if hashMove is not None and (checkers < 2 or hashMove.startSq == kingSq) \
+                    and self.isLegalMove(hashMove, kingSq, them, checkMask, pinRays):
+                yield hashMove
+
+        if checkers > 1:  # double check, only the king can move
+            kingMoves = self.getKingMoves(kingSq, [])
+            captures = [move for move in kingMoves if move.pieceCaptured != EMPTY]
+        else:
+            captures = self.getEveryCapture()
+        if captureKey is not None:
+            captures.sort(key=captureKey, reverse=True)
+        for move in captures:
+            if move.moveID != hashMoveID and self.isLegalMove(move, kingSq, them, checkMask, pinRays):
+                yield move
+
+        if checkers > 1:
+            quiets = [move for move in kingMoves if move.pieceCaptured == EMPTY]
+        else:
+            quiets = self.getEveryQuiet()
+            if checkers == 0:
+                self.getCastleMoves(kingSq, quiets)
+        if quietKey is not None:
+            quiets.sort(key=quietKey, reverse=True)
+        for move in quiets:
+            if move.moveID != hashMoveID and self.isLegalMove(move, kingSq, them, checkMask, pinRays):
+                yield move
+
+    def findPseudoMove(self, moveID, castlingAllowed=True):
+        """The pseudo-legal move with this moveID in the current position, or None - a move ID from
+        the transposition table may belong to another position with the same index."""
+        startSq = moveID & 63
+        piece = self.squares[startSq]
+        if not piece & (WHITE if self.whiteToMove else BLACK):
+            return None
+        moves = []
+        self.moveFunctions[piece & TYPE_MASK](startSq, moves)
+        if piece & TYPE_MASK == KING and castlingAllowed and abs(((moveID >> 6) & 63) - startSq) == 2:
+            self.getCastleMoves(startSq, moves)
+        for move in moves:
+            if move.moveID == moveID:
+                return move
+        return None
+
+    def hasLegalMove(self):
+        return next(self.generateMoves(), None) is not None
+
+    def enPassantIsLegal(self, move, kingSq, them):
+        # en passant removes two pieces from one rank, so it is simply tried on the board
+        board = self.squares
+        capturedSq = (move.startSq & ~7) | (move.endSq & 7)
+        board[move.startSq] = EMPTY
+        board[capturedSq] = EMPTY
+        board[move.endSq] = move.pieceMoved
+        legal = not self.isSquareAttacked(kingSq, them)
+        board[move.startSq] = move.pieceMoved
+        board[capturedSq] = move.pieceCaptured
+        board[move.endSq] = EMPTY
+        return legal
+
+    def getLegalMovesByFiltering(self):
         moves = self.getEveryMove()
         
         if self.whiteToMove:
-            self.getCastleMoves(self.whiteKingLocation[0], self.whiteKingLocation[1], moves)
+            self.getCastleMoves(self.whiteKingLocation[0] * 8 + self.whiteKingLocation[1], moves)
         else:
-            self.getCastleMoves(self.blackKingLocation[0], self.blackKingLocation[1], moves)
+            self.getCastleMoves(self.blackKingLocation[0] * 8 + self.blackKingLocation[1], moves)
         
         for i in range(len(moves)-1, -1, -1):
             self.movePiece(moves[i])
@@ -119,47 +709,8 @@ class ChessGame:
                 moves.remove(moves[i])
             self.whiteToMove = not self.whiteToMove
             self.undoMove()
-        
-        if len(moves) == 0: # either checkmate or stalemate
-            if self.inCheck():
-                self.checkMate = True
-            self.staleMate = True
-        else:
-            self.checkMate = False
-            self.staleMate = False        
-            
-        self.enpassantPossible = tempEnPassantPossible
-        self.castleRights = tempCastleRights
-        
-        piece_count = 0
-        for row in self.board:
-            for piece in row:
-                if piece != '_':  # Assuming empty squares are represented by '_'
-                    piece_count += 1
-
-        if piece_count == 2:  # Only two pieces (the two kings) remaining
-            self.staleMate = True
-        
         return moves
    
-    def updateCastlingRights(self, move):
-        if move.pieceMoved == 'white_king':
-            self.castleRights.wks = False
-            self.castleRights.wqs = False
-        elif move.pieceMoved == 'black_king':
-            self.castleRights.bks = False
-            self.castleRights.bqs = False
-        elif move.pieceMoved == 'white_rook':
-            if move.startcol == 0 and move.startrow == 7:
-                self.castleRights.wqs = False
-            if move.startcol == 7 and move.startrow == 7:
-                self.castleRights.wks = False
-        elif move.pieceMoved == 'black_rook':
-            if move.startcol == 0 and move.startrow == 0:
-                self.castleRights.bqs = False
-            if move.startcol == 7 and move.startrow == 0:
-                self.castleRights.bks = False
-          
     def inCheck(self):
         if self.whiteToMove:
             return self.squareUnderAttack(self.whiteKingLocation[0], self.whiteKingLocation[1])
@@ -167,171 +718,275 @@ class ChessGame:
             return self.squareUnderAttack(self.blackKingLocation[0], self.blackKingLocation[1])
         
     def squareUnderAttack(self, row, col):
-        self.whiteToMove = not self.whiteToMove
-        opponentMove = self.getEveryMove()
-        self.whiteToMove = not self.whiteToMove
-        for move in opponentMove:
-            if move.endrow == row and move.endcol == col:
+        if self.legacyMoveGen:
+            self.whiteToMove = not self.whiteToMove
+            opponentMove = self.getEveryMove()
+            self.whiteToMove = not self.whiteToMove
+            sq = row * 8 + col
+            for move in opponentMove:
+                if move.endSq == sq:
+                    return True
+            return False
+        return self.isSquareAttacked(row * 8 + col, BLACK if self.whiteToMove else WHITE)
+
+    def isSquareAttacked(self, sq, byColor):
+        """Checks whether any piece of byColor attacks sq, looking outwards from sq with the attack lookups."""
+        board = self.squares
+        for target in KNIGHT_TARGETS[sq]:
+            if board[target] == byColor | KNIGHT:
                 return True
+        for target in PAWN_ATTACKERS[byColor][sq]:
+            if board[target] == byColor | PAWN:
+                return True
+        for target in KING_TARGETS[sq]:
+            if board[target] == byColor | KING:
+                return True
+        rook, bishop, queen = byColor | ROOK, byColor | BISHOP, byColor | QUEEN
+        for ray in ROOK_RAYS[sq]:
+            for target in ray:
+                piece = board[target]
+                if piece != EMPTY:
+                    if piece == rook or piece == queen:
+                        return True
+                    break
+        for ray in BISHOP_RAYS[sq]:
+            for target in ray:
+                piece = board[target]
+                if piece != EMPTY:
+                    if piece == bishop or piece == queen:
+                        return True
+                    break
         return False
         
     def getEveryMove(self):
         possibleMoves = []
+        board = self.squares
+        color = WHITE if self.whiteToMove else BLACK
         
-        for row in range(len(self.board)):
-            for col in range(len(self.board[row])):
-                player = self.board[row][col].split("_")[0]
-                if (player == 'white' and self.whiteToMove) or (player == 'black' and not self.whiteToMove):
-                    piece = self.board[row][col].split("_")[1]
-                    self.moveFunctions[piece](row, col, possibleMoves)                
+        for sq in range(64):
+            piece = board[sq]
+            if piece & color:
+                self.moveFunctions[piece & TYPE_MASK](sq, possibleMoves)
 
         return possibleMoves
 
-    def getPawnMoves(self, row, col, moves):
-        
-        if self.whiteToMove and (row >= 0 and row <= 7) and (col >= 0 and col <= 7):
-            if self.board[row-1][col] == '_':
-                moves.append(Move((row, col), (row-1, col), self.board))
-                # double advance on first move
-                if row == 6 and row-2 >= 0 and self.board[row-2][col] == '_':
-                    moves.append(Move((row,col), (row-2,col), self.board))
-            # pawn capture
-            if col - 1 >= 0:
-                if self.board[row-1][col-1].split("_")[0] == 'black':
-                    moves.append(Move((row,col), (row-1, col-1), self.board))
-                elif (row-1,col-1) == self.enpassantPossible:
-                    moves.append(Move((row,col), (row-1, col-1), self.board, isEnPassant=True))
-            if col + 1 <= 7:
-                if self.board[row-1][col+1].split("_")[0] == 'black':
-                    moves.append(Move((row,col),(row-1,col+1),self.board)) 
-                elif (row-1,col+1) == self.enpassantPossible:
-                    moves.append(Move((row,col), (row-1, col+1), self.board, isEnPassant=True))
-        
-        if not self.whiteToMove  and (row >= 0 and row <= 7) and (col >= 0 and col <= 7):
-            if self.board[row+1][col] == '_':
-                moves.append(Move((row, col), (row+1, col), self.board))
-                # double advance on first move
-                if row == 1 and row+2 < len(self.board) and self.board[row+2][col] == '_':
-                    moves.append(Move((row,col), (row+2,col), self.board))
-            # pawn capture
-            if col - 1 >= 0:
-                if self.board[row+1][col-1].split("_")[0] == 'white':
-                    moves.append(Move((row,col), (row+1, col-1), self.board))
-                elif (row+1,col-1) == self.enpassantPossible:
-                    moves.append(Move((row,col), (row+1, col-1), self.board, isEnPassant=True))
-            if col + 1 <= 7:
-                if self.board[row+1][col+1].split("_")[0] == 'white':
-                    moves.append(Move((row,col),(row+1,col+1),self.board)) 
-                elif (row+1,col+1) == self.enpassantPossible:
-                    moves.append(Move((row,col), (row+1, col+1), self.board, isEnPassant=True))
-            
-    def getRookMoves(self, row, col, moves):
-        directions = [(1, 0), (-1, 0), (0, 1), (0, -1)]
-        for dr, dc in directions:
-            r, c = row + dr, col + dc
-            while self.isValidPosition(r, c):
-                if self.board[r][c] == '_':
-                    moves.append(Move((row, col), (r, c), self.board))
-                elif self.board[r][c].startswith('black' if self.whiteToMove else 'white'):
-                    moves.append(Move((row, col), (r, c), self.board))
-                    break
+    def getEveryCapture(self):
+        """Pseudo-legal captures, en passant and promotions, found straight from the attack lookups
+        without generating quiet moves."""
+        captures = []
+        board = self.squares
+        enpassantSq = self.enpassantSq
+        if self.whiteToMove:
+            us, them, forward, promotionRow = WHITE, BLACK, -8, 0
+        else:
+            us, them, forward, promotionRow = BLACK, WHITE, 8, 7
+
+        for sq in range(64):
+            piece = board[sq]
+            if not piece & us:
+                continue
+            pieceType = piece & TYPE_MASK
+            if pieceType == PAWN:
+                # pawns on sq are attacked from the squares a pawn of the other colour would attack them from,
+                # so the opponent's PAWN_ATTACKERS table gives this pawn's capture squares
+                for target in PAWN_ATTACKERS[them][sq]:
+                    if board[target] & them:
+                        self.addPawnMove(sq, target, captures)
+                    elif target == enpassantSq:
+                        captures.append(Move(sq, target, board, isEnPassant=True))
+                target = sq + forward
+                if target >> 3 == promotionRow and board[target] == EMPTY:
+                    self.addPawnMove(sq, target, captures)
+            elif pieceType == KNIGHT or pieceType == KING:
+                for target in (KNIGHT_TARGETS[sq] if pieceType == KNIGHT else KING_TARGETS[sq]):
+                    if board[target] & them:
+                        captures.append(Move(sq, target, board))
+            else:
+                rays = ROOK_RAYS[sq] if pieceType == ROOK else BISHOP_RAYS[sq] if pieceType == BISHOP else RAYS[sq]
+                for ray in rays:
+                    for target in ray:
+                        if board[target] != EMPTY:
+                            if board[target] & them:
+                                captures.append(Move(sq, target, board))
+                            break
+        return captures
+
+    def getEveryQuiet(self):
+        """Pseudo-legal moves that neither capture nor promote, castling aside - the moves
+        getEveryCapture leaves out."""
+        quiets = []
+        board = self.squares
+        if self.whiteToMove:
+            us, forward, startRow, promotionRow = WHITE, -8, 6, 0
+        else:
+            us, forward, startRow, promotionRow = BLACK, 8, 1, 7
+
+        for sq in range(64):
+            piece = board[sq]
+            if not piece & us:
+                continue
+            pieceType = piece & TYPE_MASK
+            if pieceType == PAWN:
+                target = sq + forward
+                if board[target] == EMPTY and target >> 3 != promotionRow:
+                    quiets.append(Move(sq, target, board))
+                    if sq >> 3 == startRow and board[target + forward] == EMPTY:
+                        quiets.append(Move(sq, target + forward, board))
+            elif pieceType == KNIGHT or pieceType == KING:
+                for target in (KNIGHT_TARGETS[sq] if pieceType == KNIGHT else KING_TARGETS[sq]):
+                    if board[target] == EMPTY:
+                        quiets.append(Move(sq, target, board))
+            else:
+                rays = ROOK_RAYS[sq] if pieceType == ROOK else BISHOP_RAYS[sq] if pieceType == BISHOP else RAYS[sq]
+                for ray in rays:
+                    for target in ray:
+                        if board[target] != EMPTY:
+                            break
+                        quiets.append(Move(sq, target, board))
+        return quiets
+
+    def getPawnMoves(self, sq, moves):
+        board = self.squares
+        enpassantSq = self.enpassantSq
+        if self.whiteToMove:
+            them, forward, startRow = BLACK, -8, 6
+        else:
+            them, forward, startRow = WHITE, 8, 1
+
+        target = sq + forward
+        if board[target] == EMPTY:
+            self.addPawnMove(sq, target, moves)
+            # double advance on first move
+            if sq >> 3 == startRow and board[target + forward] == EMPTY:
+                moves.append(Move(sq, target + forward, board))
+        # pawn capture, see getEveryCapture for why the opponent's table is used
+        for target in PAWN_ATTACKERS[them][sq]:
+            if board[target] & them:
+                self.addPawnMove(sq, target, moves)
+            elif target == enpassantSq:
+                moves.append(Move(sq, target, board, isEnPassant=True))
+
+    def addPawnMove(self, startSq, endSq, moves):
+        if endSq < 8 or endSq >= 56:  # promotion, queen first since it is almost always best
+            for promotionPiece in PROMOTION_PIECES:
+                moves.append(Move(startSq, endSq, self.squares, promotionPiece=promotionPiece))
+        else:
+            moves.append(Move(startSq, endSq, self.squares))
+
+    def getSlidingMoves(self, sq, moves, rays):
+        board = self.squares
+        enemy = BLACK if self.whiteToMove else WHITE
+        for ray in rays:
+            for target in ray:
+                piece = board[target]
+                if piece == EMPTY:
+                    moves.append(Move(sq, target, board))
                 else:
+                    if piece & enemy:
+                        moves.append(Move(sq, target, board))
                     break
-                r += dr
-                c += dc
         return moves
+            
+    def getRookMoves(self, sq, moves):
+        return self.getSlidingMoves(sq, moves, ROOK_RAYS[sq])
     
-    def getKnightMoves(self, row, col, moves):
-        directions = [(2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2)]
-        for dr, dc in directions:
-            r, c = row + dr, col + dc
-            if r >= 0 and r <= 7 and c >= 0 and c <= 7:
-                if self.board[r][c].startswith('black' if self.whiteToMove else 'white') or self.board[r][c] == '_':
-                    moves.append(Move((row, col), (r, c), self.board))
+    def getKnightMoves(self, sq, moves):
+        board = self.squares
+        friend = WHITE if self.whiteToMove else BLACK
+        for target in KNIGHT_TARGETS[sq]:
+            if not board[target] & friend:
+                moves.append(Move(sq, target, board))
         return moves
     
-    def getBishopMoves(self, row, col, moves):
-        directions = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
-        for dr, dc in directions:
-            r, c = row + dr, col + dc
-            while self.isValidPosition(r, c):
-                if self.board[r][c] == '_':
-                    moves.append(Move((row, col), (r, c), self.board))
-                elif self.board[r][c].startswith('black' if self.whiteToMove else 'white'):
-                    moves.append(Move((row, col), (r, c), self.board))
-                    break
-                else:
-                    break
-                r += dr
-                c += dc
-        return moves
+    def getBishopMoves(self, sq, moves):
+        return self.getSlidingMoves(sq, moves, BISHOP_RAYS[sq])
     
-    def getQueenMoves(self, row, col, moves):
-        return self.getRookMoves(row, col, moves) + self.getBishopMoves(row, col, moves)
-
-    def getKingMoves(self, row, col, moves):
-        directions = [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)]
-        for dr, dc in directions:
-            r, c = row + dr, col + dc
-            if self.isValidPosition(r, c) and (self.board[r][c] == '_' or self.board[r][c].startswith('black' if self.whiteToMove else 'white')):
-                moves.append(Move((row, col), (r, c), self.board))
+    def getQueenMoves(self, sq, moves):
+        return self.getSlidingMoves(sq, moves, RAYS[sq])
+
+    def getKingMoves(self, sq, moves):
+        board = self.squares
+        friend = WHITE if self.whiteToMove else BLACK
+        for target in KING_TARGETS[sq]:
+            if not board[target] & friend:
+                moves.append(Move(sq, target, board))
         return moves
 
-    def getCastleMoves(self, row, col, moves):
-        if self.squareUnderAttack(row, col):
+    def getCastleMoves(self, sq, moves):
+        if self.squareUnderAttack(sq >> 3, sq & 7):
             return  # can't castle while in check
-        if (self.whiteToMove and self.castleRights.wks) or (not self.whiteToMove and self.castleRights.bks):
-            self.getKingsideCastleMoves(row, col, moves)
-        if (self.whiteToMove and self.castleRights.wqs) or (not self.whiteToMove and self.castleRights.bqs):
-            self.getQueensideCastleMoves(row, col, moves)
+        if self.castlingRights & (WHITE_KINGSIDE if self.whiteToMove else BLACK_KINGSIDE):
+            self.getKingsideCastleMoves(sq, moves)
+        if self.castlingRights & (WHITE_QUEENSIDE if self.whiteToMove else BLACK_QUEENSIDE):
+            self.getQueensideCastleMoves(sq, moves)
 
-    def getKingsideCastleMoves(self, row, col, moves):
-        if self.board[row][col + 1] == '_' and self.board[row][col + 2] == '_':
+    def getKingsideCastleMoves(self, sq, moves):
+        row, col = sq >> 3, sq & 7
+        if self.squares[sq + 1] == EMPTY and self.squares[sq + 2] == EMPTY:
             if not self.squareUnderAttack(row, col + 1) and not self.squareUnderAttack(row, col + 2):
-                moves.append(Move((row, col), (row, col + 2), self.board, isCastleMove=True))
+                moves.append(Move(sq, sq + 2, self.squares, isCastleMove=True))
 
-    def getQueensideCastleMoves(self, row, col, moves):
-        if self.board[row][col - 1] == '_' and self.board[row][col - 2] == '_' and self.board[row][col - 3] == '_':
+    def getQueensideCastleMoves(self, sq, moves):
+        row, col = sq >> 3, sq & 7
+        if self.squares[sq - 1] == EMPTY and self.squares[sq - 2] == EMPTY and self.squares[sq - 3] == EMPTY:
             if not self.squareUnderAttack(row, col - 1) and not self.squareUnderAttack(row, col - 2):
-                moves.append(Move((row, col), (row, col - 2), self.board, isCastleMove=True))
+                moves.append(Move(sq, sq - 2, self.squares, isCastleMove=True))
     
-################################################################################
-#  CLASS TO DEFINE CASTLE PIECES
-################################################################################
-class CanCastle:
-    def __init__(self, wks, bks, wqs, bqs):
-        self.wks = wks
-        self.bks = bks
-        self.wqs = wqs
-        self.bqs = bqs
-         
 ################################################################################
 #  MOVE CLASS
 ################################################################################
 class Move:
-    def __init__(self, start, end, board, isEnPassant=False, isCastleMove=False):
-        self.startrow = start[0]
-        self.startcol = start[1]
-        self.endrow = end[0]
-        self.endcol = end[1]
-        self.board = board
-        self.moveID = self.startrow * 1000 + self.startcol * 100 + self.endrow * 10 + self.endcol
-        
-        self.pieceMoved = board[self.startrow][self.startcol]
-        self.pieceCaptured = board[self.endrow][self.endcol]
-                
+    # millions of these are made per search, so they are kept small: fixed slots, squares as
+    # board indices, and no reference back to the board they were generated on
+    __slots__ = ('startSq', 'endSq', 'pieceMoved', 'pieceCaptured', 'isEnPassant', 'isCastleMove',
+                 'isPawnPromotion', 'promotionPiece', 'moveID')
+
+    def __init__(self, startSq, endSq, board, isEnPassant=False, isCastleMove=False, promotionPiece=QUEEN):
+        """startSq and endSq are board indices (row * 8 + col); board is only read for the pieces on them."""
+        self.startSq = startSq
+        self.endSq = endSq
+        self.pieceMoved = pieceMoved = board[startSq]
         self.isEnPassant = isEnPassant
-        if self.isEnPassant:
-            self.pieceCaptured = 'white_pawn' if self.pieceMoved == 'black_pawn' else 'black_pawn'
-            
         self.isCastleMove = isCastleMove
+        self.promotionPiece = promotionPiece
+        self.moveID = startSq | endSq << 6
+        if isEnPassant:
+            self.pieceCaptured = WHITE | PAWN if pieceMoved == BLACK | PAWN else BLACK | PAWN
+        else:
+            self.pieceCaptured = board[endSq]
+        self.isPawnPromotion = pieceMoved & TYPE_MASK == PAWN and (endSq < 8 or endSq >= 56)
+        if self.isPawnPromotion and promotionPiece != QUEEN:
+            # under-promotions get their own IDs; a queen promotion keeps the plain from/to ID
+            # so a move built from two clicks matches it
+            self.moveID |= promotionPiece << 12
+
+    @property
+    def startrow(self):
+        return self.startSq >> 3
+
+    @property
+    def startcol(self):
+        return self.startSq & 7
+
+    @property
+    def endrow(self):
+        return self.endSq >> 3
+
+    @property
+    def endcol(self):
+        return self.endSq & 7
         
-        self.isPawnPromotion = ((self.pieceMoved == 'white_pawn' and self.endrow == 0) or (self.pieceMoved == 'black_pawn' and self.endrow == 7))
-        
+    def getNotation(self):
+        """Coordinate notation as used by UCI, e.g. 'e2e4' or 'e7e8q'."""
+        notation = squareName(self.startSq >> 3, self.startSq & 7) + squareName(self.endSq >> 3, self.endSq & 7)
+        if self.isPawnPromotion:
+            notation += 'xpnbrqk'[self.promotionPiece]
+        return notation
+
     def __eq__(self, other):
         if isinstance(other, Move):
             return self.moveID == other.moveID
         return False
-            
-        
-        
\ No newline at end of file
+
+    def __hash__(self):
+        return self.moveID
@@ -1,16 +1,17 @@
 import pygame
 from pygame.locals import *
-from chessEngine import ChessGame, Move
-from chessAI import findBestMove, randomMoveGenerator
-from multiprocessing import Process, Queue
+from chessEngine import ChessGame, Move, EMPTY, WHITE, BLACK, COLOR_MASK, PIECE_NAMES
+from chessAI import randomMoveGenerator, probeBook
+from chessWorker import SearchWorker
 
 WIDTH = HEIGHT = 512    # UI SIZE
 DIMENSION = 8           # 8 x 8 board
 SQ_SIZE = WIDTH // DIMENSION
-MAX_FPS = 1000
+AI_POLL_MS = 20         # how often the window checks on the AI while it is thinking
+PONDER = True           # let the AI keep searching while the human thinks
 
-WHITE = (232, 235, 239)
-BLACK = (125, 135, 150)
+LIGHT_SQUARE = (232, 235, 239)
+DARK_SQUARE = (125, 135, 150)
 
 ################################################################################
 #  LOAD IMAGE FILES
@@ -27,11 +28,15 @@ def loadImages():
 def main():
     pygame.init()
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
-    clock = pygame.time.Clock()
-    screen.fill(pygame.Color('white'))
+    # only mouse, keyboard and window events wake the loop up
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed([QUIT, MOUSEBUTTONDOWN, KEYDOWN, VIDEOEXPOSE, WINDOWEXPOSED])
     
     gc = ChessGame()
     loadImages()
+    renderer = BoardRenderer(screen)
+    # one search process for the whole game, it keeps its tables between moves
+    searchWorker = SearchWorker()
     
     animate = False
     
@@ -39,6 +44,7 @@ def main():
     moveMade = False # flag to avoid calling the above method too often
     moveUndone = False
     aiIsThinking = False
+    aiIsPondering = False
         
     cellClicked = ()
     historicalClicks = []
@@ -49,17 +55,28 @@ def main():
     playerOne = False # True for human, false for bot
     playerTwo = False # True for human, false for bot
     
+    renderer.draw(gc, validMoves, cellClicked)
     running = True
     while running:
         
         humanTurn = (gc.whiteToMove and playerOne) or (not gc.whiteToMove and playerTwo)
         
-        for event in pygame.event.get():
+        # sleep until something happens; while the AI is to move, wake up regularly to poll it
+        if gameOver or humanTurn:
+            events = [pygame.event.wait()]
+        else:
+            events = [pygame.event.wait(AI_POLL_MS)]
+        events += pygame.event.get()
+        for event in events:
             if event.type == QUIT:
                 running = False
+                searchWorker.close()
                 pygame.quit()
                 quit()
             
+            elif event.type == VIDEOEXPOSE or event.type == WINDOWEXPOSED:
+                renderer.invalidate()  # the window contents were lost, draw everything again
+            
             elif event.type == MOUSEBUTTONDOWN and not gameOver:
                 mouse_pos = pygame.mouse.get_pos()
                 x = mouse_pos[0] // SQ_SIZE
@@ -69,7 +86,7 @@ def main():
                     cellClicked = ()
                     historicalClicks = []
                 else:
-                    if len(historicalClicks) == 0 and gc.board[y][x] == '_':
+                    if len(historicalClicks) == 0 and gc.squares[y * 8 + x] == EMPTY:
                         # if a user clicks an empty cell before selecting their piece
                         cellClicked = ()
                         historicalClicks = []
@@ -79,11 +96,12 @@ def main():
                     
                 # They have clicked somewhere before and are clicking again   
                 if len (historicalClicks) == 2:
-                    if gc.board[historicalClicks[0][0]][historicalClicks[0][1]] == "_":
+                    if gc.squares[historicalClicks[0][0] * 8 + historicalClicks[0][1]] == EMPTY:
                         cellClicked = ()
                         historicalClicks = []
                     else:
-                        move = Move(historicalClicks[0], historicalClicks[1], gc.board)
+                        (startRow, startCol), (endRow, endCol) = historicalClicks
+                        move = Move(startRow * 8 + startCol, endRow * 8 + endCol, gc.squares)
                         for i in range(len(validMoves)):
                             if move == validMoves[i]:
                                 gc.movePiece(validMoves[i])
@@ -96,6 +114,10 @@ def main():
                 
             elif event.type == KEYDOWN:
                 if event.key == K_u:
+                    if aiIsThinking or aiIsPondering:  # the search was for the position being taken back
+                        searchWorker.stop()
+                        aiIsThinking = False
+                        aiIsPondering = False
                     gc.undoMove()
                     animate = False
                     moveMade = True
@@ -105,19 +127,34 @@ def main():
         ################################################################################
         if not gameOver and not humanTurn and not moveUndone:
             
-            if not aiIsThinking:
-                aiIsThinking = True
-                returnQueue = Queue()
-                moveFinder = Process(target=findBestMove, args=(gc,validMoves,returnQueue))
-                moveFinder.start()
-                
-            if not moveFinder.is_alive():
-                aiMove = returnQueue.get()
-                if aiMove is None:
-                    aiMove = randomMoveGenerator()
-                gc.movePiece(aiMove)
+            # book moves are played straight away, without a round trip to the search process
+            bookMove = None if aiIsThinking else probeBook(gc, validMoves)
+            if bookMove is not None:
+                if aiIsPondering:
+                    searchWorker.stop()
+                    aiIsPondering = False
+                gc.movePiece(bookMove)
                 moveMade = True
-                aiIsThinking = False
+            else:
+                if not aiIsThinking:
+                    aiIsThinking = True
+                    # when the human played the reply the AI was pondering, that search carries on
+                    if not (aiIsPondering and searchWorker.ponderHit(gc)):
+                        searchWorker.startSearch(gc)
+                    aiIsPondering = False
+                    
+                report = searchWorker.poll()
+                if report is not None and report.final:
+                    aiMove = next((move for move in validMoves if move.getNotation() == report.move), None)
+                    if aiMove is None:
+                        aiMove = randomMoveGenerator(validMoves)
+                    gc.movePiece(aiMove)
+                    moveMade = True
+                    aiIsThinking = False
+                    if PONDER and ((gc.whiteToMove and playerOne) or (not gc.whiteToMove and playerTwo)):
+                        # search the reply the AI expects while the human thinks about it
+                        searchWorker.ponder(gc, report.pv[1] if len(report.pv) > 1 else None)
+                        aiIsPondering = True
         # if not gameOver and not humanTurn:
         #     aiMove = randomMoveGenerator(validMoves)
         #     gc.movePiece(aiMove)
@@ -138,51 +175,76 @@ def main():
                 drawEndGameText(screen, "White wins by checkmate")
         elif gc.staleMate:
             gameOver = True
-            drawEndGameText(screen, "Stalemate")
+            drawEndGameText(screen, "Stalemate" if gc.drawReason == 'stalemate' else f"Draw by {gc.drawReason}")
+        if gameOver and aiIsPondering:
+            # the human's move ended the game, so the reply being pondered will never be needed
+            searchWorker.stop()
+            aiIsPondering = False
 
 
-        drawGameConfig(screen, gc, validMoves, cellClicked)
-        clock.tick(MAX_FPS)
-        pygame.display.flip()
+        renderer.draw(gc, validMoves, cellClicked)
     
  
 ################################################################################
 #  GRAPHICS
 ################################################################################
-def drawGameConfig(screen, gc, validMoves, cellClicked):
-    drawTiles(screen)
-    highlightSquare(screen, gc, validMoves, cellClicked)
-    drawPieces(screen, gc.board)
-
-def drawTiles(screen):
-    global colours
-    colours = [WHITE, BLACK]
-    for row in range(DIMENSION):
-        for col in range(DIMENSION):
-            colour = colours[(row + col) % 2]            
-            pygame.draw.rect(screen, colour, pygame.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-    
-def drawPieces(screen, board):
-    for row in range(DIMENSION):
-        for col in range(DIMENSION):
-
-            piece = board[row][col]
-            if piece != '_':
-                screen.blit(IMAGES[piece], (col*SQ_SIZE, row*SQ_SIZE))
-
-def highlightSquare(screen, gc, validMoves, cellClicked):
-    if cellClicked != ():
-        row, col = cellClicked
-        if gc.board[row][col].split("_")[0] == ('white' if gc.whiteToMove else 'black'):
+class BoardRenderer:
+    """Draws the board by redrawing only the squares whose piece or highlight changed since the
+    last frame, and pushes just those squares to the display."""
+    def __init__(self, screen):
+        self.screen = screen
+        # tiles are drawn once; a square is repainted by copying its part of this background
+        self.background = pygame.Surface((WIDTH, HEIGHT))
+        colours = [LIGHT_SQUARE, DARK_SQUARE]
+        for row in range(DIMENSION):
+            for col in range(DIMENSION):
+                pygame.draw.rect(self.background, colours[(row + col) % 2], pygame.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+        self.highlights = {}
+        for kind, colour in (('selected', 'blue'), ('target', 'yellow')):
             square = pygame.Surface((SQ_SIZE, SQ_SIZE))
             square.set_alpha(100)
-            square.fill(pygame.Color('blue'))
-            screen.blit(square, (col*SQ_SIZE, row*SQ_SIZE))
-            
-            square.fill(pygame.Color('yellow'))
-            for move in validMoves:
-                if move.startrow == row and move.startcol == col:
-                    screen.blit(square, (SQ_SIZE*move.endcol, SQ_SIZE*move.endrow))
+            square.fill(pygame.Color(colour))
+            self.highlights[kind] = square
+        self.rects = [pygame.Rect((sq & 7)*SQ_SIZE, (sq >> 3)*SQ_SIZE, SQ_SIZE, SQ_SIZE) for sq in range(64)]
+        self.shown = None  # (piece, highlight) drawn on every square, None before the first frame
+
+    def invalidate(self):
+        self.shown = None
+
+    def draw(self, gc, validMoves, cellClicked):
+        wanted = [(piece, None) for piece in gc.squares]
+        for sq, kind in highlightedSquares(gc, validMoves, cellClicked):
+            wanted[sq] = (gc.squares[sq], kind)
+
+        if self.shown is None:
+            self.screen.blit(self.background, (0, 0))
+            dirty = range(64)
+        else:
+            dirty = [sq for sq in range(64) if wanted[sq] != self.shown[sq]]
+        for sq in dirty:
+            rect = self.rects[sq]
+            piece, kind = wanted[sq]
+            self.screen.blit(self.background, rect, rect)
+            if kind is not None:
+                self.screen.blit(self.highlights[kind], rect)
+            if piece != EMPTY:
+                self.screen.blit(IMAGES[PIECE_NAMES[piece]], rect)
+
+        if self.shown is None:
+            pygame.display.flip()
+        elif dirty:
+            pygame.display.update([self.rects[sq] for sq in dirty])
+        self.shown = wanted
+
+def highlightedSquares(gc, validMoves, cellClicked):
+    """(square, kind) pairs for the selected piece and the squares it can move to."""
+    if cellClicked == ():
+        return []
+    row, col = cellClicked
+    sq = row * 8 + col
+    if gc.squares[sq] & COLOR_MASK != (WHITE if gc.whiteToMove else BLACK):
+        return []
+    return [(sq, 'selected')] + [(move.endSq, 'target') for move in validMoves if move.startSq == sq]
     
 def drawEndGameText(screen, text):
     pass
@@ -0,0 +1,261 @@
+"""
+HEADLESS BOT-VS-BOT MATCHES BETWEEN ENGINE CONFIGURATIONS
+
+    python chessMatch.py --engine name=new,time=0.2 --engine name=old,depth=3 --games 100 --out match.jsonl
+
+Engine options are comma separated key=value pairs: name, time (seconds per move), depth, nodes,
+tt (transposition table MB), pvs/nullmove/lmr (0 or 1, to switch those parts of the search off or
+on), scores (a file of piece values and position tables from chessTune.py) and
+pawn/knight/bishop/rook/queen to override material values.
+Games run in a process pool and each finished game is written straight away as one JSON line
+(plus a PGN game with --pgn), so a long match can be watched or stopped part way.
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import time
+from multiprocessing import Pool
+from chessEngine import ChessGame, START_FEN
+import chessAI
+
+MAX_PLIES = 600  # games still going after this many plies are scored as draws
+SEARCH_FEATURES = {"pvs": "USE_PVS", "nullmove": "USE_NULL_MOVE", "lmr": "USE_LMR"}  # option -> chessAI flag
+
+################################################################################
+#  ENGINE CONFIGURATIONS
+################################################################################
+class EngineConfig:
+    def __init__(self, name, timeLimit=None, maxDepth=chessAI.MAX_DEPTH, nodeLimit=None, ttSizeMB=4, pieceValues=None):
+        self.name = name
+        self.timeLimit = timeLimit
+        self.maxDepth = maxDepth
+        self.nodeLimit = nodeLimit
+        self.ttSizeMB = ttSizeMB
+        self.pieceValues = pieceValues or {}  # material overrides, e.g. {"bishop": 3.25}
+        self.scoresPath = None  # tuned values and tables to evaluate with instead of chessAI's
+        self.features = {}  # chessAI search flags to set, e.g. {"USE_LMR": False}
+
+    @classmethod
+    def parse(cls, text):
+        """Builds a config from 'name=A,time=0.1,depth=4,bishop=3.25' style options."""
+        options = dict(part.split('=', 1) for part in text.split(',') if part)
+        config = cls(options.pop('name', text))
+        if 'time' in options:
+            config.timeLimit = float(options.pop('time'))
+        if 'depth' in options:
+            config.maxDepth = int(options.pop('depth'))
+        if 'nodes' in options:
+            config.nodeLimit = int(options.pop('nodes'))
+        if 'tt' in options:
+            config.ttSizeMB = float(options.pop('tt'))
+        if 'scores' in options:
+            config.scoresPath = options.pop('scores')
+        for option in list(options):
+            if option in SEARCH_FEATURES:
+                config.features[SEARCH_FEATURES[option]] = options.pop(option) not in ('0', 'off', 'false')
+        for piece in list(options):
+            if piece not in chessAI.piece_score:
+                raise ValueError(f"unknown engine option '{piece}'")
+            config.pieceValues[piece] = float(options.pop(piece))
+        if config.timeLimit is None and config.nodeLimit is None and config.maxDepth == chessAI.MAX_DEPTH:
+            raise ValueError(f"engine '{config.name}' needs a time, depth or nodes limit")
+        return config
+
+class MatchEngine:
+    """An engine configuration playing one game: its own copy of the position (so it can use its
+    own evaluation) and its own transposition table."""
+    def __init__(self, config, fen):
+        self.config = config
+        self.gc = ChessGame(fen)
+        if config.scoresPath:
+            pieceValues, tables = chessAI.readTunedScores(config.scoresPath)
+            self.gc.setPieceSquareScores(chessAI.buildPieceSquareScores(dict(pieceValues, **config.pieceValues),
+                                                                        chessAI.buildPositionScores(tables)))
+        elif config.pieceValues:
+            self.gc.setPieceSquareScores(chessAI.buildPieceSquareScores(dict(chessAI.piece_score, **config.pieceValues)))
+        self.table = chessAI.TranspositionTable(config.ttSizeMB)
+
+    def think(self):
+        # both engines play in the same process, so the search flags are set again before every move
+        for flag in SEARCH_FEATURES.values():
+            setattr(chessAI, flag, self.config.features.get(flag, True))
+        return chessAI.findBestMove(self.gc, self.gc.getAllLegalMoves(), timeLimit=self.config.timeLimit,
+                                    nodeLimit=self.config.nodeLimit, maxDepth=self.config.maxDepth, table=self.table)
+
+################################################################################
+#  PLAYING GAMES
+################################################################################
+def randomOpening(plies, seed):
+    """FEN-free opening: a few random legal moves from the start position, as coordinate notation."""
+    rng = random.Random(seed)
+    gc = ChessGame()
+    moves = []
+    for ply in range(plies):
+        legalMoves = gc.getAllLegalMoves()
+        if not legalMoves:
+            break
+        move = rng.choice(legalMoves)
+        moves.append(move.getNotation())
+        gc.movePiece(move)
+    return moves
+
+def playGame(task):
+    """Plays one game and returns its record as a JSON-ready dict."""
+    gameIndex, whiteConfig, blackConfig, fen, openingMoves = task
+    random.seed(gameIndex)
+    engines = [MatchEngine(whiteConfig, fen), MatchEngine(blackConfig, fen)]
+    referee = ChessGame(fen)
+    for notation in openingMoves:
+        move = referee.parseMove(notation)
+        referee.movePiece(move)
+        for engine in engines:
+            engine.gc.movePiece(engine.gc.parseMove(notation))
+
+    moves, sanMoves, times, nodes, depths, scores = [], [], [], [], [], []
+    start = time.perf_counter()
+    result, termination = '1/2-1/2', 'max plies'
+    while len(referee.moveLog) < MAX_PLIES:
+        referee.getAllLegalMoves()  # sets the checkmate and draw flags
+        if referee.checkMate:
+            result, termination = ('0-1' if referee.whiteToMove else '1-0'), 'checkmate'
+            break
+        if referee.staleMate:
+            termination = referee.drawReason
+            break
+        engine = engines[0 if referee.whiteToMove else 1]
+        search = engine.think()
+        notation = search.move.getNotation()
+        move = referee.parseMove(notation)
+        sanMoves.append(referee.getSAN(move))
+        referee.movePiece(move)
+        for other in engines:
+            other.gc.movePiece(other.gc.parseMove(notation))
+        moves.append(notation)
+        times.append(round(search.elapsed, 4))
+        nodes.append(search.nodes)
+        depths.append(search.depth)
+        scores.append(round(search.score, 2))
+
+    return {"game": gameIndex, "white": whiteConfig.name, "black": blackConfig.name, "fen": fen,
+            "opening": openingMoves, "result": result, "termination": termination, "moves": moves,
+            "san": sanMoves, "times": times, "nodes": nodes, "depths": depths, "scores": scores,
+            "elapsed": round(time.perf_counter() - start, 3)}
+
+def formatPGN(record):
+    referee = ChessGame(record["fen"])
+    sanMoves = []
+    for notation in record["opening"]:
+        move = referee.parseMove(notation)
+        sanMoves.append(referee.getSAN(move))
+        referee.movePiece(move)
+    sanMoves += record["san"]
+    startsWhite = ChessGame(record["fen"]).whiteToMove
+    body = []
+    for i, san in enumerate(sanMoves):
+        ply = i + (0 if startsWhite else 1)
+        if ply % 2 == 0:
+            body.append(f"{ply // 2 + 1}.")
+        elif i == 0:
+            body.append(f"{ply // 2 + 1}...")
+        body.append(san)
+    body.append(record["result"])
+    headers = [f'[Event "chessometer match"]', f'[Round "{record["game"] + 1}"]', f'[White "{record["white"]}"]',
+               f'[Black "{record["black"]}"]', f'[Result "{record["result"]}"]', f'[Termination "{record["termination"]}"]']
+    if record["fen"] != START_FEN:
+        headers += [f'[SetUp "1"]', f'[FEN "{record["fen"]}"]']
+    return "\n".join(headers) + "\n\n" + " ".join(body) + "\n\n"
+
+################################################################################
+#  RESULTS
+################################################################################
+def eloDifference(wins, losses, draws):
+    """Elo difference of the first engine over the second with a 95% error margin, from the score
+    fraction and its per-game standard deviation. Returns (elo, margin); a clean sweep has an
+    infinite Elo difference and margin."""
+    games = wins + losses + draws
+    if games == 0:
+        return 0.0, math.inf
+    score = (wins + draws / 2) / games
+
+    def toElo(fraction):
+        if fraction <= 0:
+            return -math.inf
+        if fraction >= 1:
+            return math.inf
+        return -400 * math.log10(1 / fraction - 1)
+
+    variance = (wins * (1 - score) ** 2 + losses * score ** 2 + draws * (0.5 - score) ** 2) / games
+    deviation = math.sqrt(variance / games)
+    elo = toElo(score)
+    if not math.isfinite(elo):
+        return elo, math.inf
+    # an interval end past 0 or 1 is clamped to half a point from it, so the margin stays finite
+    low, high = 0.5 / games, 1 - 0.5 / games
+    upper = min(max(score + 1.96 * deviation, low), high)
+    lower = min(max(score - 1.96 * deviation, low), high)
+    return elo, (toElo(upper) - toElo(lower)) / 2
+
+def runMatch(first, second, games, out, pgnOut=None, workers=None, openingPlies=4, fen=START_FEN, seed=0, log=sys.stdout):
+    """Plays games between two EngineConfigs, alternating colours on the same opening for each
+    pair of games. Returns (wins, losses, draws) from first's point of view."""
+    tasks = []
+    for i in range(games):
+        opening = randomOpening(openingPlies, seed + i // 2) if fen == START_FEN else []
+        white, black = (first, second) if i % 2 == 0 else (second, first)
+        tasks.append((i, white, black, fen, opening))
+
+    wins = losses = draws = 0
+    start = time.perf_counter()
+    with Pool(workers) as pool:
+        for record in pool.imap_unordered(playGame, tasks):
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            if pgnOut is not None:
+                pgnOut.write(formatPGN(record))
+                pgnOut.flush()
+            if record["result"] == '1/2-1/2':
+                draws += 1
+            elif (record["result"] == '1-0') == (record["white"] == first.name):
+                wins += 1
+            else:
+                losses += 1
+            played = wins + losses + draws
+            elapsed = time.perf_counter() - start
+            elo, margin = eloDifference(wins, losses, draws)
+            # rounded to an int first, so a small negative difference prints as +0 rather than -0
+            elo = f"{round(elo):+d}" if math.isfinite(elo) else "n/a"
+            margin = f"{round(margin)}" if math.isfinite(margin) else "n/a"
+            print(f"{played}/{games}  +{wins} -{losses} ={draws}  {played / elapsed:.2f} games/s  "
+                  f"elo {first.name} - {second.name}: {elo} +/- {margin}", file=log)
+    return wins, losses, draws
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play engine configurations against each other without the GUI.")
+    parser.add_argument("--engine", action="append", required=True, help="engine options, given exactly twice")
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=None, help="processes in the pool (default: one per core)")
+    parser.add_argument("--opening-plies", type=int, default=4, help="random plies played before the engines take over")
+    parser.add_argument("--fen", default=START_FEN, help="start every game from this position instead")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="match.jsonl", help="JSON lines file, one record per game")
+    parser.add_argument("--pgn", default=None, help="also write the games to this PGN file")
+    args = parser.parse_args(argv)
+    if len(args.engine) != 2:
+        parser.error("give --engine exactly twice")
+    first, second = (EngineConfig.parse(text) for text in args.engine)
+    if first.name == second.name:
+        parser.error("the two engines need different names")
+
+    with open(args.out, "w") as out:
+        pgnOut = open(args.pgn, "w") if args.pgn else None
+        try:
+            runMatch(first, second, args.games, out, pgnOut, args.workers, args.opening_plies, args.fen, args.seed)
+        finally:
+            if pgnOut is not None:
+                pgnOut.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
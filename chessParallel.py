@@ -0,0 +1,101 @@
+"""
+PARALLEL SEARCH - LAZY SMP OVER A TRANSPOSITION TABLE IN SHARED MEMORY
+
+Helper processes search the same position as the main search at the same time. They do not
+split the work explicitly; what they find lands in the shared transposition table, where the
+main search picks it up as cutoffs and hash moves.
+
+    python chessParallel.py --workers 1 2 4 --depth 5     # time-to-depth benchmark
+"""
+import argparse
+import os
+import sys
+import time
+from multiprocessing.shared_memory import SharedMemory
+from chessEngine import ChessGame, START_FEN
+from chessWorker import SearchWorker
+import chessAI
+
+class ParallelSearch:
+    def __init__(self, workers=os.cpu_count() or 1, ttSizeMB=chessAI.TT_SIZE_MB):
+        """workers counts the calling process, so workers=1 is a plain serial search."""
+        self.sharedMemory = SharedMemory(create=True, size=chessAI.TranspositionTable.bytesNeeded(ttSizeMB))
+        self.table = chessAI.TranspositionTable(ttSizeMB, self.sharedMemory.buf)
+        self.helpers = [SearchWorker(sharedTable=(self.sharedMemory.name, ttSizeMB)) for i in range(workers - 1)]
+
+    def newGame(self, fen=START_FEN):
+        for helper in self.helpers:
+            helper.newGame(fen)
+        self.table.clear()
+
+    def findBestMove(self, gc, validMoves, timeLimit=chessAI.TIME_LIMIT, nodeLimit=None, maxDepth=chessAI.MAX_DEPTH,
+                     stopEvent=None, onIteration=None, useBook=True):
+        """Same arguments and SearchResult as chessAI.findBestMove; nodes includes the helpers' nodes."""
+        if useBook and validMoves:
+            bookMove = chessAI.probeBook(gc, validMoves)
+            if bookMove is not None:
+                return chessAI.SearchResult(bookMove, 0, 0, [bookMove], 0, 0.0, fromBook=True)
+        for i, helper in enumerate(self.helpers):
+            # every other helper starts one ply deeper so the helpers do not all search the same tree
+            helper.startSearch(gc, timeLimit=None, maxDepth=maxDepth, startDepth=1 + (i + 1) % 2, reportIterations=False)
+        try:
+            result = chessAI.findBestMove(gc, validMoves, timeLimit=timeLimit, nodeLimit=nodeLimit, maxDepth=maxDepth,
+                                          stopEvent=stopEvent, onIteration=onIteration, table=self.table, useBook=False)
+        finally:
+            for helper in self.helpers:
+                helper.stop()
+        for helper in self.helpers:
+            report = helper.waitForResult()
+            if report is not None:
+                result.nodes += report.nodes
+        return result
+
+    def close(self):
+        for helper in self.helpers:
+            helper.close()
+        self.table.release()
+        self.sharedMemory.close()
+        self.sharedMemory.unlink()
+
+################################################################################
+#  BENCHMARK
+################################################################################
+BENCHMARK_POSITIONS = [
+    START_FEN,
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP2BPPP/R2QKB1R w KQ - 0 8",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+]
+
+def timeToDepth(workers, depth, positions=BENCHMARK_POSITIONS):
+    """Total seconds and nodes for a fresh ParallelSearch to complete depth on every position."""
+    search = ParallelSearch(workers)
+    totalTime = totalNodes = 0
+    try:
+        for fen in positions:
+            search.newGame(fen)
+            gc = ChessGame(fen)
+            start = time.perf_counter()
+            result = search.findBestMove(gc, gc.getAllLegalMoves(), timeLimit=None, maxDepth=depth, useBook=False)
+            totalTime += time.perf_counter() - start
+            totalNodes += result.nodes
+    finally:
+        search.close()
+    return totalTime, totalNodes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure time-to-depth of the parallel search for several worker counts.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--depth", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    print(f"{os.cpu_count()} cores available")
+    baseline = None
+    for workers in args.workers:
+        elapsed, nodes = timeToDepth(workers, args.depth)
+        baseline = baseline or elapsed
+        print(f"{workers:>3} workers  depth {args.depth}  {elapsed:8.2f}s  {nodes:>9} nodes  speedup {baseline / elapsed:5.2f}x")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
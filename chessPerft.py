@@ -0,0 +1,153 @@
+"""
+PERFT - COUNTS THE LEAF NODES OF THE LEGAL MOVE TREE TO VALIDATE AND BENCHMARK MOVE GENERATION
+
+    python chessPerft.py --depth 4                     # start position
+    python chessPerft.py --fen "<fen>" --depth 3 --divide
+    python chessPerft.py --suite --max-nodes 1000000   # check the reference positions
+"""
+import argparse
+import sys
+import time
+from chessEngine import ChessGame, START_FEN
+
+################################################################################
+#  REFERENCE POSITIONS
+################################################################################
+# (name, fen, {depth: leaf nodes}) - published counts, promotions to every piece included
+REFERENCE_POSITIONS = [
+    ("start position", START_FEN,
+     {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    ("en passant and rook endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ("promotions and castling rights", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    ("promotion with check", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    ("en passant pinned along rank", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1", {6: 1134888}),
+    ("en passant discovered check", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1", {6: 1440467}),
+    ("en passant gives check", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1", {6: 1015133}),
+    ("short castle gives check", "5k2/8/8/8/8/8/8/4K2R w K - 0 1", {6: 661072}),
+    ("long castle gives check", "3k4/8/8/8/8/8/8/R3K3 w Q - 0 1", {6: 803711}),
+    ("castling rights lost by rook capture", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1", {4: 1274206}),
+    ("castling prevented", "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1", {4: 1720476}),
+    ("promote out of check", "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1", {6: 3821001}),
+    ("discovered check", "8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1", {5: 1004658}),
+    ("promote to give check", "4k3/1P6/8/8/8/8/K7/8 w - - 0 1", {6: 217342}),
+    ("under-promote to give check", "8/P1k5/K7/8/8/8/8/8 w - - 0 1", {6: 92683}),
+    ("self stalemate", "K1k5/8/P7/8/8/8/8/8 w - - 0 1", {6: 2217}),
+    ("stalemate and checkmate", "8/k1P5/8/1K6/8/8/8/8 w - - 0 1", {7: 567584}),
+    ("double check", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1", {4: 23527}),
+    # FEN fields that do not match the board are dropped on loading, so these count as if they were '-'
+    ("castling right without a rook", "4k3/8/8/8/8/8/8/4K3 w K - 0 1", {6: 53896}),
+    ("en passant square without a pawn", "rnbqkbnr/ppp1pppp/8/4P3/8/8/PPPP1PPP/RNBQKBNR w KQkq d6 0 1", {4: 778051}),
+]
+
+################################################################################
+#  PERFT
+################################################################################
+def perft(gc, depth):
+    """Number of leaf nodes of the legal move tree below the current position."""
+    moves = gc.getAllLegalMoves()
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    nodes = 0
+    for move in moves:
+        gc.movePiece(move)
+        nodes += perft(gc, depth - 1)
+        gc.undoMove()
+    return nodes
+
+def perftStaged(gc, depth):
+    """perft walking the search's staged generator (ChessGame.generateMoves) instead."""
+    if depth == 0:
+        return 1
+    nodes = 0
+    for move in gc.generateMoves():
+        gc.movePiece(move)
+        nodes += perftStaged(gc, depth - 1)
+        gc.undoMove()
+    return nodes
+
+def divide(gc, depth, count=perft):
+    """Leaf counts below each root move, keyed by the move in coordinate notation - the usual way
+    to find which move a generator bug hides under when comparing against another engine."""
+    counts = {}
+    for move in gc.getAllLegalMoves():
+        gc.movePiece(move)
+        counts[move.getNotation()] = count(gc, depth - 1)
+        gc.undoMove()
+    return counts
+
+class PerftResult:
+    def __init__(self, fen, depth, nodes, elapsed, divided=None):
+        self.fen = fen
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.divided = divided
+
+    @property
+    def nodesPerSecond(self):
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+def runPerft(fen=START_FEN, depth=3, showDivide=False, legacyMoveGen=False, staged=False):
+    gc = ChessGame(fen)
+    gc.legacyMoveGen = legacyMoveGen
+    count = perftStaged if staged else perft
+    start = time.perf_counter()
+    if showDivide:
+        divided = divide(gc, depth, count)
+        nodes = sum(divided.values())
+    else:
+        divided = None
+        nodes = count(gc, depth)
+    return PerftResult(fen, depth, nodes, time.perf_counter() - start, divided)
+
+def runSuite(maxNodes=200000, legacyMoveGen=False, out=sys.stdout, staged=False):
+    """Checks every reference count up to maxNodes leaves. Returns the list of mismatches as
+    (name, depth, expected, actual)."""
+    failures = []
+    totalNodes = totalTime = 0
+    for name, fen, counts in REFERENCE_POSITIONS:
+        for depth, expected in sorted(counts.items()):
+            if expected > maxNodes:
+                break
+            result = runPerft(fen, depth, legacyMoveGen=legacyMoveGen, staged=staged)
+            totalNodes += result.nodes
+            totalTime += result.elapsed
+            status = "ok" if result.nodes == expected else f"FAIL (expected {expected})"
+            print(f"{name:40} depth {depth}  {result.nodes:>10}  {result.nodesPerSecond:>10.0f} nodes/s  {status}", file=out)
+            if result.nodes != expected:
+                failures.append((name, depth, expected, result.nodes))
+    if totalTime > 0:
+        print(f"{totalNodes} nodes in {totalTime:.2f}s, {totalNodes / totalTime:.0f} nodes/s, {len(failures)} failures", file=out)
+    return failures
+
+################################################################################
+#  COMMAND LINE
+################################################################################
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count legal move tree leaves to validate and benchmark move generation.")
+    parser.add_argument("--fen", default=START_FEN, help="position to search (default: start position)")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--divide", action="store_true", help="print the count below every root move")
+    parser.add_argument("--suite", action="store_true", help="check the built-in reference positions")
+    parser.add_argument("--max-nodes", type=int, default=200000, help="skip suite entries with more leaves than this")
+    parser.add_argument("--legacy", action="store_true", help="use the old make/undo filtering move generator")
+    parser.add_argument("--staged", action="store_true", help="use the search's staged move generator")
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        return 1 if runSuite(args.max_nodes, args.legacy, staged=args.staged) else 0
+
+    result = runPerft(args.fen, args.depth, args.divide, args.legacy, args.staged)
+    if result.divided is not None:
+        for notation, count in sorted(result.divided.items()):
+            print(f"{notation}: {count}")
+    print(f"nodes {result.nodes}  time {result.elapsed:.2f}s  {result.nodesPerSecond:.0f} nodes/s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
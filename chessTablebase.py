@@ -0,0 +1,438 @@
+"""
+ENDGAME TABLEBASES - DISTANCE TO MATE FOR KQK, KRK, KPK AND KBNK BY RETROGRADE ANALYSIS
+
+    python chessTablebase.py generate            # writes tablebases/KQK.tb, KRK.tb, KPK.tb, KBNK.tb
+    python chessTablebase.py probe "8/8/8/4k3/8/8/8/4K2R w - - 0 1"
+    python chessTablebase.py verify --samples 2000
+
+Every table holds one byte per position with the strong side as white: 0 for a draw (or a
+position that cannot occur), otherwise 1 + the number of plies to mate, a loss for the side to
+move when that number is even and a win when it is odd. Positions are folded by symmetry (eight
+ways without pawns, left-right with one) and the files are memory mapped, so a probe is a few
+lookups and the tables cost nothing until used. Positions with black as the strong side are
+probed with the board turned round.
+
+Generation works backwards from the mates: a position where black is to move is lost once every
+black move reaches a won position, one where white is to move is won as soon as one move reaches
+a lost position, and positions are settled in order of distance so the first distance found is
+the shortest. Moves come from the engine's attack lookups; 'verify' checks the tables against
+ChessGame's own legal move generation.
+"""
+import argparse
+import mmap
+import os
+import random
+import sys
+import time
+from chessEngine import (ChessGame, EMPTY, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, WHITE, BLACK,
+                         KING_TARGETS, KNIGHT_TARGETS, PAWN_ATTACKERS, RAYS, FEN_CHARS)
+
+TABLEBASE_DIR = "tablebases"
+# white's pieces besides the king in each table, in the order they are indexed
+TABLES = {"KQK": (QUEEN,), "KRK": (ROOK,), "KPK": (PAWN,), "KBNK": (BISHOP, KNIGHT)}
+# tables that have to exist before a table can be generated, for promotions
+DEPENDENCIES = {"KPK": ("KQK", "KRK")}
+MATERIAL_ORDER = (QUEEN, ROOK, BISHOP, KNIGHT, PAWN)
+MATERIAL_LETTERS = {QUEEN: 'Q', ROOK: 'R', BISHOP: 'B', KNIGHT: 'N', PAWN: 'P'}
+
+################################################################################
+#  SYMMETRY AND INDEXING
+################################################################################
+def _transform(sq, t):
+    row, col = sq >> 3, sq & 7
+    if t & 1:
+        col = 7 - col
+    if t & 2:
+        row = 7 - row
+    if t & 4:
+        row, col = col, row
+    return row * 8 + col
+
+# the eight ways of turning the board, as square -> square tables
+TRANSFORMS = [[_transform(sq, t) for sq in range(64)] for t in range(8)]
+# white king squares kept when folding a pawnless position: the a1-d1-d4 triangle
+TRIANGLE = [sq for sq in range(64) if sq % 8 <= 3 and 7 - sq // 8 <= sq % 8]
+TRIANGLE_INDEX = {sq: i for i, sq in enumerate(TRIANGLE)}
+# ways of turning the board that bring a white king on sq into the triangle (two along its diagonal)
+TRIANGLE_TRANSFORMS = [[t for t in range(8) if TRANSFORMS[t][sq] in TRIANGLE_INDEX] for sq in range(64)]
+MIRROR = TRANSFORMS[1]  # a-file <-> h-file, the only symmetry left once there are pawns
+
+# squares strictly between two squares on a line, and which sliders move along that line
+BETWEEN = [[None] * 64 for sq in range(64)]
+LINE_SLIDERS = [[() for target in range(64)] for sq in range(64)]
+for _sq in range(64):
+    for _direction, _ray in enumerate(RAYS[_sq]):
+        for _i, _target in enumerate(_ray):
+            BETWEEN[_sq][_target] = _ray[:_i]
+            LINE_SLIDERS[_sq][_target] = (ROOK, QUEEN) if _direction < 4 else (BISHOP, QUEEN)
+KING_SETS = [frozenset(targets) for targets in KING_TARGETS]
+KNIGHT_SETS = [frozenset(targets) for targets in KNIGHT_TARGETS]
+
+class TableLayout:
+    """Maps positions of one material set (white king, black king, white pieces, side to move:
+    0 for white, 1 for black) to table indexes and back."""
+    def __init__(self, name):
+        self.name = name
+        self.types = TABLES[name]
+        self.hasPawns = PAWN in self.types
+        self.kingSquares = [sq for sq in range(64) if sq % 8 <= 3] if self.hasPawns else TRIANGLE
+        self.kingIndex = {sq: i for i, sq in enumerate(self.kingSquares)}
+        self.size = 2 * len(self.kingSquares) * 64 ** (1 + len(self.types))
+
+    def canonical(self, squares):
+        """The symmetric image of (white king, black king, pieces...) that the table stores: the
+        white king in the kept squares, and of two such images (a king on the diagonal) the smaller."""
+        if self.hasPawns:
+            return squares if squares[0] % 8 <= 3 else tuple(MIRROR[sq] for sq in squares)
+        transforms = TRIANGLE_TRANSFORMS[squares[0]]
+        if len(transforms) == 1:
+            table = TRANSFORMS[transforms[0]]
+            return tuple(table[sq] for sq in squares)
+        return min(tuple(TRANSFORMS[t][sq] for sq in squares) for t in transforms)
+
+    def index(self, stm, squares):
+        squares = self.canonical(squares)
+        index = 0
+        for sq in reversed(squares[1:]):
+            index = index * 64 + sq
+        return stm + 2 * (self.kingIndex[squares[0]] + len(self.kingSquares) * index)
+
+    def decode(self, index):
+        stm, rest = index & 1, index >> 1
+        rest, king = divmod(rest, len(self.kingSquares))
+        squares = [self.kingSquares[king]]
+        for i in range(1 + len(self.types)):
+            rest, sq = divmod(rest, 64)
+            squares.append(sq)
+        return stm, tuple(squares)
+
+################################################################################
+#  POSITIONS AND MOVES
+################################################################################
+def whiteAttacks(sq, squares, types, ignore=-1):
+    """True if white's king or pieces attack sq. ignore is a square left out as a blocker (the
+    black king, when it is the one moving) and a piece standing on it is left out too."""
+    if sq in KING_SETS[squares[0]]:
+        return True
+    occupied = squares
+    for pieceSq, pieceType in zip(squares[2:], types):
+        if pieceSq == ignore or pieceSq == sq:
+            continue
+        if pieceType == KNIGHT:
+            if sq in KNIGHT_SETS[pieceSq]:
+                return True
+        elif pieceType == PAWN:
+            if pieceSq in PAWN_ATTACKERS[WHITE][sq]:
+                return True
+        elif pieceType in LINE_SLIDERS[pieceSq][sq]:
+            if not any(between in occupied and between != ignore for between in BETWEEN[pieceSq][sq]):
+                return True
+    return False
+
+def isLegal(stm, squares, types):
+    """Whether the position can occur: no two pieces on one square, kings apart, no pawns on the
+    first or last rank, and the side that just moved not left in check."""
+    if len(set(squares)) != len(squares) or squares[1] in KING_SETS[squares[0]]:
+        return False
+    for sq, pieceType in zip(squares[2:], types):
+        if pieceType == PAWN and (sq < 8 or sq >= 56):
+            return False
+    # with white to move, black's king must not be in check; black cannot check white
+    return stm == 1 or not whiteAttacks(squares[1], squares, types)
+
+def blackKingMoves(squares, types):
+    """The black king's legal moves as (target square, captured piece index or -1)."""
+    moves = []
+    blackKing = squares[1]
+    for target in KING_TARGETS[blackKing]:
+        if target in KING_SETS[squares[0]] or target == squares[0]:
+            continue
+        captured = squares.index(target, 2) - 2 if target in squares[2:] else -1
+        # a capture takes the piece off the board, which whiteAttacks ignores on the target square
+        if not whiteAttacks(target, squares, types, ignore=blackKing):
+            moves.append((target, captured))
+    return moves
+
+def whiteUnmoves(squares, types):
+    """Positions (white to move) from which one white move leads to squares, black to move."""
+    occupied = set(squares)
+    previous = []
+    for i in range(len(squares)):
+        if i == 1:
+            continue
+        sq = squares[i]
+        pieceType = KING if i == 0 else types[i - 2]
+        if pieceType == KING or pieceType == KNIGHT:
+            origins = [origin for origin in (KING_TARGETS[sq] if pieceType == KING else KNIGHT_TARGETS[sq])
+                       if origin not in occupied]
+        elif pieceType == PAWN:
+            origins = []
+            # white pawns move up the board, towards row 0
+            if sq + 8 < 56 and sq + 8 not in occupied:
+                origins.append(sq + 8)
+                if sq // 8 == 4 and sq + 16 not in occupied:
+                    origins.append(sq + 16)
+        else:
+            origins = []
+            for direction, ray in enumerate(RAYS[sq]):
+                if (direction < 4 and pieceType == BISHOP) or (direction >= 4 and pieceType == ROOK):
+                    continue
+                for origin in ray:
+                    if origin in occupied:
+                        break
+                    origins.append(origin)
+        for origin in origins:
+            previous.append(squares[:i] + (origin,) + squares[i + 1:])
+    return previous
+
+################################################################################
+#  GENERATION
+################################################################################
+def generate(name, dependencies=None, log=None):
+    """Builds the table for one material set and returns it as a bytearray. dependencies maps
+    the names of the tables promotions lead to onto (TableLayout, bytes)."""
+    layout = TableLayout(name)
+    types = layout.types
+    table = bytearray(layout.size)
+    buckets = [[] for plies in range(256)]
+    start = time.perf_counter()
+
+    # seeds: black checkmated, and white promotions into positions already known to be lost for black
+    positions = 0
+    for index in range(layout.size):
+        stm, squares = layout.decode(index)
+        if not isLegal(stm, squares, types) or layout.index(stm, squares) != index:
+            continue
+        positions += 1
+        if stm == 1:
+            if not blackKingMoves(squares, types) and whiteAttacks(squares[1], squares, types):
+                buckets[0].append(index)
+        elif layout.hasPawns and dependencies:
+            best = None
+            for i, pieceType in enumerate(types):
+                sq = squares[i + 2]
+                if pieceType != PAWN or sq >= 16 or sq - 8 in squares:
+                    continue
+                promoted = squares[:i + 2] + (sq - 8,) + squares[i + 3:]
+                for promotedName, (promotedLayout, promotedTable) in dependencies.items():
+                    value = promotedTable[promotedLayout.index(1, promoted)]
+                    if value and (value - 1) % 2 == 0 and (best is None or value < best):
+                        best = value  # lost for black in value - 1 plies, so won here in value
+            if best is not None:
+                buckets[best].append(index)
+    if log is not None:
+        print(f"{name}: {positions} positions, {len(buckets[0])} mates ({time.perf_counter() - start:.1f}s)", file=log)
+
+    for plies in range(255):
+        for index in buckets[plies]:
+            if table[index]:
+                continue
+            table[index] = plies + 1
+            stm, squares = layout.decode(index)
+            if stm == 1:
+                # lost for black: every white move leading here wins
+                for previous in whiteUnmoves(squares, types):
+                    if isLegal(0, previous, types):
+                        previousIndex = layout.index(0, previous)
+                        if not table[previousIndex]:
+                            buckets[plies + 1].append(previousIndex)
+            else:
+                # won for white: the black moves leading here might now all lose
+                for origin in KING_TARGETS[squares[1]]:
+                    if origin in squares or origin in KING_SETS[squares[0]]:
+                        continue
+                    previous = squares[:1] + (origin,) + squares[2:]
+                    previousIndex = layout.index(1, previous)
+                    if not table[previousIndex] and blackIsLost(previous, types, layout, table):
+                        buckets[plies + 1].append(previousIndex)
+        if log is not None and buckets[plies]:
+            print(f"{name}: {len(buckets[plies])} positions at {plies} plies ({time.perf_counter() - start:.1f}s)", file=log)
+        buckets[plies] = None
+    return table
+
+def blackIsLost(squares, types, layout, table):
+    """True when every black move from squares (black to move) reaches a position already won for white."""
+    moves = blackKingMoves(squares, types)
+    if not moves:
+        return False  # stalemate, checkmates are seeded separately
+    for target, captured in moves:
+        if captured >= 0:
+            return False  # taking a piece leaves a drawn ending
+        value = table[layout.index(0, (squares[0], target) + squares[2:])]
+        if not value or (value - 1) % 2 == 0:
+            return False
+    return True
+
+def tablePath(name, directory=None):
+    return os.path.join(directory or TABLEBASE_DIR, name + ".tb")
+
+def generateFiles(names, directory=TABLEBASE_DIR, log=None):
+    os.makedirs(directory, exist_ok=True)
+    built = {}
+    for name in names:
+        dependencies = {}
+        for dependency in DEPENDENCIES.get(name, ()):
+            if dependency not in built:
+                with open(tablePath(dependency, directory), 'rb') as file:
+                    built[dependency] = file.read()
+            dependencies[dependency] = (TableLayout(dependency), built[dependency])
+        table = generate(name, dependencies, log)
+        with open(tablePath(name, directory), 'wb') as out:
+            out.write(table)
+        built[name] = table
+
+################################################################################
+#  PROBING
+################################################################################
+class Tablebase:
+    def __init__(self, name, path):
+        self.layout = TableLayout(name)
+        with open(path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.data) != self.layout.size:
+            raise ValueError(f"{path} has {len(self.data)} bytes, expected {self.layout.size}")
+
+    def value(self, stm, squares):
+        return self.data[self.layout.index(stm, squares)]
+
+openTables = {}  # name -> Tablebase, or None when its file is missing; filled on first use
+
+def getTable(name):
+    if name not in openTables:
+        path = tablePath(name)
+        openTables[name] = Tablebase(name, path) if os.path.exists(path) else None
+    return openTables[name]
+
+def materialKey(counts, color):
+    return ''.join(MATERIAL_LETTERS[pieceType] * counts[color | pieceType] for pieceType in MATERIAL_ORDER)
+
+def probe(gc):
+    """Looks gc's position up. Returns (result, plies) for the side to move - result 1 for a win,
+    -1 for a loss, 0 for a draw, plies to mate for a win or loss - or None when no table covers it."""
+    if gc.castlingRights:
+        return None
+    whiteKey, blackKey = materialKey(gc.pieceCounts, WHITE), materialKey(gc.pieceCounts, BLACK)
+    if whiteKey and not blackKey:
+        strong, flip = WHITE, 0
+        name = 'K' + whiteKey + 'K'
+    elif blackKey and not whiteKey:
+        strong, flip = BLACK, 56  # turn the board round so the strong side plays up it as white
+        name = 'K' + blackKey + 'K'
+    else:
+        return None
+    if name not in TABLES:
+        return None
+    table = getTable(name)
+    if table is None:
+        return None
+    weak = BLACK if strong == WHITE else WHITE
+    board = gc.squares
+    squares = [board.index(strong | KING) ^ flip, board.index(weak | KING) ^ flip]
+    for pieceType in table.layout.types:
+        squares.append(board.index(strong | pieceType) ^ flip)
+    stm = 0 if gc.whiteToMove == (strong == WHITE) else 1
+    value = table.value(stm, tuple(squares))
+    if value == 0:
+        return 0, 0
+    plies = value - 1
+    return (1 if plies % 2 else -1), plies
+
+################################################################################
+#  VERIFICATION AGAINST THE ENGINE'S MOVE GENERATION
+################################################################################
+def positionFEN(name, stm, squares):
+    board = [EMPTY] * 64
+    board[squares[0]], board[squares[1]] = WHITE | KING, BLACK | KING
+    for sq, pieceType in zip(squares[2:], TABLES[name]):
+        board[sq] = WHITE | pieceType
+    rows = []
+    for row in range(8):
+        text, empty = '', 0
+        for piece in board[row * 8:row * 8 + 8]:
+            if piece == EMPTY:
+                empty += 1
+            else:
+                text += (str(empty) if empty else '') + FEN_CHARS[piece]
+                empty = 0
+        rows.append(text + (str(empty) if empty else ''))
+    return f"{'/'.join(rows)} {'wb'[stm]} - - 0 1"
+
+def verify(names, samples, seed=0, out=sys.stdout):
+    """Checks random positions against a one-ply search with ChessGame: a win in n plies must have
+    a move to a loss in n - 1, a loss in n every move leading to a win in at most n - 1, a draw no
+    move to a loss. Returns the number of mismatches."""
+    rng = random.Random(seed)
+    failures = 0
+    for name in names:
+        layout = TableLayout(name)
+        checked = 0
+        while checked < samples:
+            stm, squares = layout.decode(rng.randrange(layout.size))
+            if not isLegal(stm, squares, layout.types):
+                continue
+            gc = ChessGame(positionFEN(name, stm, squares))
+            own = probe(gc)
+            children = []
+            for move in gc.getAllLegalMoves():
+                gc.movePiece(move)
+                child = probe(gc)
+                if child is None:
+                    child = (0, 0) if gc.hasInsufficientMaterial() else None
+                if gc.inCheck() and not gc.getAllLegalMoves():
+                    child = (-1, 0)
+                gc.undoMove()
+                children.append(child)
+            result, plies = own
+            if any(child is None for child in children):
+                continue  # a promotion into a table this run cannot check
+            if result == 1:
+                ok = any(child == (-1, plies - 1) for child in children) and \
+                     all(not (r == -1 and p < plies - 1) for r, p in children)
+            elif result == -1:
+                ok = (not children and gc.inCheck() and plies == 0) or \
+                     (children and all(r == 1 for r, p in children) and max(p for r, p in children) == plies - 1)
+            else:
+                ok = all(r != -1 for r, p in children)
+            if not ok:
+                failures += 1
+                print(f"{name}: {positionFEN(name, stm, squares)} stored {own}, children {sorted(children)}", file=out)
+            checked += 1
+        print(f"{name}: {checked} positions checked", file=out)
+    return failures
+
+################################################################################
+#  COMMAND LINE
+################################################################################
+def main(argv=None):
+    global TABLEBASE_DIR
+    parser = argparse.ArgumentParser(description="Generate, probe and verify the endgame tablebases.")
+    parser.add_argument("--dir", default=TABLEBASE_DIR, help="directory of the table files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generateCommand = commands.add_parser("generate", help="build table files")
+    generateCommand.add_argument("tables", nargs="*", default=list(TABLES), help="tables to build (default: all)")
+    probeCommand = commands.add_parser("probe", help="look a position up")
+    probeCommand.add_argument("fen")
+    verifyCommand = commands.add_parser("verify", help="check random positions against the engine's move generation")
+    verifyCommand.add_argument("tables", nargs="*", default=list(TABLES))
+    verifyCommand.add_argument("--samples", type=int, default=1000)
+    args = parser.parse_args(argv)
+    TABLEBASE_DIR = args.dir
+
+    if args.command == "generate":
+        unknown = [name for name in args.tables if name not in TABLES]
+        if unknown:
+            parser.error(f"unknown tables: {', '.join(unknown)}")
+        generateFiles(args.tables, args.dir, sys.stderr)
+    elif args.command == "probe":
+        found = probe(ChessGame(args.fen))
+        if found is None:
+            print("not in the tablebases")
+        else:
+            result, plies = found
+            print("draw" if result == 0 else f"{'win' if result > 0 else 'loss'} in {plies} plies")
+    else:
+        return 1 if verify(args.tables, args.samples) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+"""
+TEXEL TUNING - FITS THE PIECE VALUES AND POSITION TABLES TO GAME RESULTS
+
+    python chessTune.py encode games.pgn selfplay.pgn --out positions
+    python chessTune.py fit positions --out tuned.json --epochs 300
+
+encode plays through the games once and appends every quiet position to positions.boards (64 piece
+codes per position, uint8) and the game's result to positions.results (int8, 1 for a white win, 0
+for a draw, -1 for a loss), so the games are parsed only once however often the tables are refitted.
+Self-play games come from chessMatch.py --pgn.
+
+fit memory maps both files and lowers the mean squared error between each result and
+sigmoid(evaluation) with full-batch gradient steps (Adam), in chunks, so millions of positions
+never have to fit in memory. The evaluation is linear in the weights, so a chunk's scores are one
+gather and sum, and its gradient one bincount. The tuned values and tables are written as JSON in
+chessAI's layout. chessAI evaluates with them when the environment variable CHESS_TUNED_SCORES
+names the file (chessMatch.py can also give one engine a file with scores=tuned.json).
+"""
+import argparse
+import json
+import math
+import sys
+import time
+import numpy as np
+import chessAI
+from chessBook import readPGN
+from chessEngine import ChessGame, PIECE_TYPES, PIECE_NAMES, EMPTY, WHITE, TYPE_MASK, START_FEN
+
+RESULTS = {'1-0': 1, '1/2-1/2': 0, '0-1': -1}  # '*' games are skipped
+CHUNK = 1 << 16  # positions scored at a time while fitting
+TYPE_NAMES = {code: name for name, code in PIECE_TYPES.items()}
+TYPES = max(PIECE_TYPES.values()) + 1
+
+################################################################################
+#  ENCODING POSITIONS
+################################################################################
+def quietPositions(games, skipPlies=8, log=None):
+    """Yields (squares, result) for the quiet positions of every (headers, moves) game with a known
+    result: past the opening, side to move not in check and the move played not a capture or a
+    promotion, since a static evaluation cannot see the exchange that is about to happen."""
+    for gameNumber, (headers, moves) in enumerate(games, 1):
+        result = RESULTS.get(headers.get('Result'))
+        if result is None:
+            continue
+        try:
+            gc = ChessGame(headers.get('FEN', START_FEN))
+        except ValueError as error:
+            if log is not None:
+                print(f"game {gameNumber}: {error}", file=log)
+            continue
+        for ply, san in enumerate(moves):
+            move = gc.parseSAN(san)
+            if move is None:
+                if log is not None:
+                    print(f"game {gameNumber}: illegal move '{san}', rest of the game skipped", file=log)
+                break
+            if ply >= skipPlies and move.pieceCaptured == EMPTY and not move.isPawnPromotion and not gc.inCheck():
+                yield bytes(gc.squares), result
+            gc.movePiece(move)
+
+def encodePositions(positions, prefix):
+    """Appends (squares, result) pairs to prefix.boards and prefix.results. Returns the number of
+    positions written."""
+    count = 0
+    with open(prefix + '.boards', 'ab') as boards, open(prefix + '.results', 'ab') as results:
+        for squares, result in positions:
+            boards.write(squares)
+            results.write(result.to_bytes(1, 'little', signed=True))
+            count += 1
+    return count
+
+def loadPositions(prefix):
+    """The (N, 64) board and (N,) result arrays of an encoded file pair, memory mapped read-only."""
+    boards = np.memmap(prefix + '.boards', dtype=np.uint8, mode='r')
+    results = np.memmap(prefix + '.results', dtype=np.int8, mode='r')
+    boards = boards.reshape(-1, 64)
+    if len(boards) != len(results):
+        raise ValueError(f"{prefix}: {len(boards)} boards but {len(results)} results")
+    return boards, results
+
+################################################################################
+#  THE EVALUATION AS A LINEAR MODEL
+################################################################################
+# every piece code reads the weight (piece type, square from white's side) with a sign: black's
+# tables are white's with the ranks reversed, which is the square with its row bits flipped
+FEATURES = np.zeros((max(PIECE_NAMES) + 1, 64), dtype=np.int64)
+PIECE_TYPE = np.zeros(max(PIECE_NAMES) + 1, dtype=np.int64)
+SIGN = np.zeros(max(PIECE_NAMES) + 1)
+for code in PIECE_NAMES:
+    if code == EMPTY:
+        continue  # empty squares keep sign 0, so they add nothing
+    PIECE_TYPE[code] = code & TYPE_MASK
+    SIGN[code] = 1 if code & WHITE else -1
+    FEATURES[code] = [(code & TYPE_MASK) * 64 + (sq if code & WHITE else sq ^ 56) for sq in range(64)]
+
+class Weights:
+    """Piece values (by type code) and position tables (by type code, then square) as flat arrays."""
+    def __init__(self, pieceValues=None, tables=None):
+        pieceValues = chessAI.piece_score if pieceValues is None else pieceValues
+        tables = chessAI.positionTables if tables is None else tables
+        self.values = np.zeros(TYPES)
+        self.tables = np.zeros(TYPES * 64)
+        for code, name in TYPE_NAMES.items():
+            self.values[code] = pieceValues[name]
+            self.tables[code * 64:(code + 1) * 64] = np.ravel(tables[name])
+
+    def scores(self, boards):
+        """White's evaluation of every board in an (N, 64) array of piece codes, the same as
+        chessAI.staticEvaluation with these values and tables."""
+        columns = np.arange(64)
+        return (SIGN[boards] * (self.tables[FEATURES[boards, columns]] + self.values[PIECE_TYPE[boards]])).sum(axis=1)
+
+    def gradients(self, boards, scoreGradients):
+        """Gradients of the values and the tables, given the gradient of the loss with respect to
+        every board's score."""
+        signed = (SIGN[boards] * scoreGradients[:, None]).ravel()
+        values = np.bincount(PIECE_TYPE[boards].ravel(), weights=signed, minlength=TYPES)
+        tables = np.bincount(FEATURES[boards, np.arange(64)].ravel(), weights=signed, minlength=TYPES * 64)
+        return values, tables
+
+    def toDict(self):
+        """Piece values and 8 x 8 tables in chessAI's layout, as readTunedScores expects them."""
+        return {"piece_score": {name: round(float(self.values[code]), 3) for code, name in TYPE_NAMES.items()},
+                "tables": {name: np.round(self.tables[code * 64:(code + 1) * 64], 3).reshape(8, 8).tolist()
+                           for code, name in TYPE_NAMES.items()}}
+
+################################################################################
+#  FITTING
+################################################################################
+def winProbability(scores, k):
+    """Expected result (0 to 1) of a position scored in pawns, the Texel sigmoid."""
+    return 1 / (1 + np.power(10.0, -k * scores / 4))
+
+def meanError(weights, boards, results, k):
+    total = 0.0
+    for start in range(0, len(boards), CHUNK):
+        targets = (results[start:start + CHUNK] + 1) / 2
+        total += np.sum((targets - winProbability(weights.scores(boards[start:start + CHUNK]), k)) ** 2)
+    return total / len(boards)
+
+def fitScale(weights, boards, results, low=0.1, high=4.0, steps=30):
+    """The sigmoid scale k that best fits the results with the current weights, by golden section
+    search. It is fixed while the weights are fitted, so the fit keeps the evaluation in pawns."""
+    ratio = (math.sqrt(5) - 1) / 2
+    a, b = high - ratio * (high - low), low + ratio * (high - low)
+    errorA, errorB = meanError(weights, boards, results, a), meanError(weights, boards, results, b)
+    for step in range(steps):
+        if errorA < errorB:
+            high, b, errorB = b, a, errorA
+            a = high - ratio * (high - low)
+            errorA = meanError(weights, boards, results, a)
+        else:
+            low, a, errorA = a, b, errorB
+            b = low + ratio * (high - low)
+            errorB = meanError(weights, boards, results, b)
+    return (low + high) / 2
+
+def fit(weights, boards, results, k, epochs=300, rate=0.01, tuneValues=True, log=None):
+    """Adam steps on the full gradient of the mean squared error. Kings keep a value of 0 (both
+    sides always have one), and table squares no position uses never get a gradient, so they keep
+    their hand-written values. Returns the final error."""
+    moments = [np.zeros(TYPES), np.zeros(TYPES * 64)]
+    squares = [np.zeros(TYPES), np.zeros(TYPES * 64)]
+    beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+    kingCode = PIECE_TYPES["king"]
+    for epoch in range(1, epochs + 1):
+        error = 0.0
+        gradients = [np.zeros(TYPES), np.zeros(TYPES * 64)]
+        for start in range(0, len(boards), CHUNK):
+            chunk = np.asarray(boards[start:start + CHUNK])
+            targets = (results[start:start + CHUNK] + 1) / 2
+            predicted = winProbability(weights.scores(chunk), k)
+            error += np.sum((targets - predicted) ** 2)
+            # d/dscore of (target - sigmoid)^2, averaged over every position
+            scoreGradients = -2 * (targets - predicted) * predicted * (1 - predicted) * k * math.log(10) / 4 / len(boards)
+            for total, part in zip(gradients, weights.gradients(chunk, scoreGradients)):
+                total += part
+        gradients[0][kingCode] = 0
+        if not tuneValues:
+            gradients[0][:] = 0
+        for params, gradient, moment, square in zip((weights.values, weights.tables), gradients, moments, squares):
+            moment *= beta1
+            moment += (1 - beta1) * gradient
+            square *= beta2
+            square += (1 - beta2) * gradient ** 2
+            params -= rate * (moment / (1 - beta1 ** epoch)) / (np.sqrt(square / (1 - beta2 ** epoch)) + epsilon)
+        if log is not None and (epoch == 1 or epoch % 10 == 0):
+            print(f"epoch {epoch:>4}  error {error / len(boards):.6f}", file=log)
+    return meanError(weights, boards, results, k)
+
+################################################################################
+#  COMMAND LINE
+################################################################################
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tune chessAI's piece values and position tables on game results.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    encode = commands.add_parser("encode", help="extract quiet positions from PGN files")
+    encode.add_argument("pgn", nargs="+", help="PGN files to read, e.g. from chessMatch.py --pgn")
+    encode.add_argument("--out", default="positions", help="prefix of the .boards and .results files (appended to)")
+    encode.add_argument("--skip-plies", type=int, default=8, help="opening plies left out of every game")
+    fitter = commands.add_parser("fit", help="fit the values and tables to encoded positions")
+    fitter.add_argument("positions", help="prefix given to encode")
+    fitter.add_argument("--out", default="tuned.json")
+    fitter.add_argument("--epochs", type=int, default=300)
+    fitter.add_argument("--rate", type=float, default=0.01, help="Adam step size, in pawns")
+    fitter.add_argument("--k", type=float, default=None, help="sigmoid scale (fitted to the data by default)")
+    fitter.add_argument("--tables-only", action="store_true", help="keep the piece values as they are")
+    args = parser.parse_args(argv)
+
+    if args.command == "encode":
+        def games():
+            for path in args.pgn:
+                with open(path, errors="replace") as file:
+                    yield from readPGN(file)
+        start = time.perf_counter()
+        count = encodePositions(quietPositions(games(), args.skip_plies, sys.stderr), args.out)
+        print(f"{count} positions added to {args.out}.boards ({time.perf_counter() - start:.1f}s)", file=sys.stderr)
+        return 0
+
+    boards, results = loadPositions(args.positions)
+    if not len(boards):
+        print(f"{args.positions}: no positions", file=sys.stderr)
+        return 1
+    weights = Weights()
+    k = fitScale(weights, boards, results) if args.k is None else args.k
+    print(f"{len(boards)} positions, k = {k:.4f}, error {meanError(weights, boards, results, k):.6f}", file=sys.stderr)
+    start = time.perf_counter()
+    error = fit(weights, boards, results, k, args.epochs, args.rate, not args.tables_only, sys.stderr)
+    print(f"error {error:.6f} after {args.epochs} epochs ({time.perf_counter() - start:.1f}s)", file=sys.stderr)
+    with open(args.out, "w") as out:
+        json.dump(weights.toDict(), out, indent=1)
+    print(f"written to {args.out}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
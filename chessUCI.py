@@ -0,0 +1,263 @@
+"""
+UCI FRONT END - LETS TOURNAMENT MANAGERS AND GUIS PLAY THE ENGINE OVER STDIN/STDOUT
+
+    python chessUCI.py
+
+Commands are read on the main thread while the search runs on a thread of its own, so 'stop',
+'ponderhit' and 'isready' are answered straight away. Supported: uci, isready, setoption (Hash,
+Threads, OwnBook), ucinewgame, position startpos|fen ... [moves ...], go (wtime, btime, winc, binc,
+movestogo, movetime, depth, nodes, infinite, ponder), stop, ponderhit and quit.
+"""
+import sys
+import threading
+import time
+from chessEngine import ChessGame, START_FEN
+from chessParallel import ParallelSearch
+import chessAI
+
+ENGINE_NAME = "chessometer"
+ENGINE_AUTHOR = "chessometer authors"
+MOVE_OVERHEAD = 0.05     # seconds kept back per move for the time it takes to send it
+DEFAULT_MOVES_TO_GO = 30  # moves the remaining time is spread over when the GUI does not say
+
+################################################################################
+#  TIME MANAGEMENT
+################################################################################
+def timeBudget(params, whiteToMove):
+    """Seconds to spend on this move from the 'go' parameters, or None for no time limit."""
+    if 'movetime' in params:
+        return max(params['movetime'] / 1000 - MOVE_OVERHEAD, 0.01)
+    remaining = params.get('wtime' if whiteToMove else 'btime')
+    if remaining is None:
+        return None
+    increment = params.get('winc' if whiteToMove else 'binc', 0)
+    movesToGo = params.get('movestogo', DEFAULT_MOVES_TO_GO)
+    budget = remaining / max(movesToGo, 1) + increment * 0.8
+    # never plan to use more than half of what is left on the clock
+    return max(min(budget, remaining / 2) / 1000 - MOVE_OVERHEAD, 0.01)
+
+class SearchClock:
+    """Stop signal handed to findBestMove: set by 'stop', or once the time budget is used up.
+    While pondering the budget does not run; 'ponderhit' starts it."""
+    def __init__(self, budget, pondering):
+        self.budget = budget
+        self.stopped = False
+        self.deadline = None
+        if budget is not None and not pondering:
+            self.deadline = time.perf_counter() + budget
+
+    def ponderhit(self):
+        if self.budget is not None:
+            self.deadline = time.perf_counter() + self.budget
+
+    def stop(self):
+        self.stopped = True
+
+    def is_set(self):
+        return self.stopped or (self.deadline is not None and time.perf_counter() >= self.deadline)
+
+################################################################################
+#  ENGINE
+################################################################################
+class UCIEngine:
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.outputLock = threading.Lock()  # the search thread prints info lines too
+        self.gc = ChessGame()
+        self.hashMB = chessAI.TT_SIZE_MB
+        self.threads = 1
+        self.useBook = True
+        self.table = chessAI.TranspositionTable(self.hashMB)
+        self.parallelSearch = None
+        self.searchThread = None
+        self.clock = None
+        self.released = threading.Event()  # set once an infinite or ponder search may report its move
+
+    def send(self, line):
+        with self.outputLock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    def run(self, source=sys.stdin):
+        for line in source:
+            if not self.handle(line):
+                break
+        self.close()
+
+    def handle(self, line):
+        """Runs one command. Returns False on 'quit'."""
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == 'uci':
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            self.send(f"option name Hash type spin default {chessAI.TT_SIZE_MB} min 1 max 4096")
+            self.send("option name Threads type spin default 1 min 1 max 64")
+            self.send("option name Ponder type check default false")
+            self.send("option name OwnBook type check default true")
+            self.send("uciok")
+        elif command == 'isready':
+            self.send("readyok")
+        elif command == 'setoption':
+            self.setOption(args)
+        elif command == 'ucinewgame':
+            self.waitForSearch()
+            self.gc = ChessGame()
+            self.table.clear()
+            if self.parallelSearch is not None:
+                self.parallelSearch.newGame()
+        elif command == 'position':
+            self.waitForSearch()
+            self.setPosition(args)
+        elif command == 'go':
+            self.waitForSearch()
+            self.go(args)
+        elif command == 'stop':
+            self.waitForSearch()
+        elif command == 'ponderhit':
+            if self.clock is not None:
+                self.clock.ponderhit()
+            self.released.set()
+        elif command == 'quit':
+            return False
+        elif command not in ('debug', 'register'):
+            self.send(f"info string unknown command '{command}'")
+        return True
+
+    def setOption(self, args):
+        # setoption name <name> value <value>, where the name may contain spaces
+        if 'name' not in args:
+            return
+        valueAt = args.index('value') if 'value' in args else len(args)
+        name = ' '.join(args[args.index('name') + 1:valueAt]).lower()
+        value = ' '.join(args[valueAt + 1:])
+        self.waitForSearch()
+        try:
+            if name == 'hash':
+                self.hashMB = max(int(value), 1)
+                self.table = chessAI.TranspositionTable(self.hashMB)
+                self.resetParallelSearch()
+            elif name == 'threads':
+                self.threads = max(int(value), 1)
+                self.resetParallelSearch()
+            elif name == 'ownbook':
+                self.useBook = value.lower() == 'true'
+        except ValueError:
+            self.send(f"info string invalid value '{value}' for option '{name}'")
+
+    def resetParallelSearch(self):
+        if self.parallelSearch is not None:
+            self.parallelSearch.close()
+            self.parallelSearch = None
+        if self.threads > 1:
+            self.parallelSearch = ParallelSearch(self.threads, self.hashMB)
+
+    def setPosition(self, args):
+        if args and args[0] == 'startpos':
+            fen, rest = START_FEN, args[1:]
+        elif args and args[0] == 'fen':
+            movesAt = args.index('moves') if 'moves' in args else len(args)
+            fen, rest = ' '.join(args[1:movesAt]), args[movesAt:]
+        else:
+            self.send("info string position needs 'startpos' or 'fen'")
+            return
+        try:
+            gc = ChessGame(fen)
+        except ValueError as error:
+            self.send(f"info string {error}")
+            return
+        for notation in rest[1:] if rest and rest[0] == 'moves' else []:
+            move = gc.parseMove(notation)
+            if move is None:
+                self.send(f"info string illegal move '{notation}'")
+                break
+            gc.movePiece(move)
+        self.gc = gc
+
+    def go(self, args):
+        params = {}
+        flags = set()
+        i = 0
+        while i < len(args):
+            if args[i] in ('infinite', 'ponder'):
+                flags.add(args[i])
+                i += 1
+            elif args[i] == 'searchmoves':
+                break  # not supported, everything after it is move lists
+            elif i + 1 < len(args):
+                try:
+                    params[args[i]] = int(args[i + 1])
+                except ValueError:
+                    pass
+                i += 2
+            else:
+                i += 1
+
+        pondering = 'ponder' in flags
+        budget = None if 'infinite' in flags else timeBudget(params, self.gc.whiteToMove)
+        self.clock = SearchClock(budget, pondering)
+        # the GUI has to say 'stop' (or 'ponderhit') before an infinite or ponder search may answer
+        if 'infinite' in flags or pondering:
+            self.released.clear()
+        else:
+            self.released.set()
+        # the search's per-ply tables only reach MAX_DEPTH plus the quiescence plies
+        maxDepth = min(params.get('depth', chessAI.MAX_DEPTH), chessAI.MAX_DEPTH)
+        self.searchThread = threading.Thread(target=self.search, args=(self.clock, maxDepth, params.get('nodes')), daemon=True)
+        self.searchThread.start()
+
+    def search(self, clock, maxDepth, nodeLimit):
+        gc = self.gc
+        validMoves = gc.getAllLegalMoves()
+        if not validMoves:
+            self.released.wait()
+            self.send("bestmove 0000")
+            return
+        if self.parallelSearch is not None:
+            result = self.parallelSearch.findBestMove(gc, validMoves, timeLimit=None, nodeLimit=nodeLimit, maxDepth=maxDepth,
+                                                      stopEvent=clock, onIteration=self.sendInfo, useBook=self.useBook)
+        else:
+            result = chessAI.findBestMove(gc, validMoves, timeLimit=None, nodeLimit=nodeLimit, maxDepth=maxDepth,
+                                          stopEvent=clock, onIteration=self.sendInfo, table=self.table, useBook=self.useBook)
+        self.released.wait()
+        bestMove = f"bestmove {result.move.getNotation()}"
+        if len(result.pv) > 1:
+            bestMove += f" ponder {result.pv[1].getNotation()}"
+        self.send(bestMove)
+
+    def sendInfo(self, result):
+        if abs(result.score) >= chessAI.CHECKMATE:
+            # mate scores carry no distance, but the principal variation ends in the mate
+            moves = (len(result.pv) + 1) // 2
+            score = f"mate {moves if result.score > 0 else -moves}"
+        elif abs(result.score) > chessAI.TABLEBASE_WIN - 3:
+            # tablebase wins count down from TABLEBASE_WIN by a hundredth per ply to the mate
+            moves = (round((chessAI.TABLEBASE_WIN - abs(result.score)) * 100) + 1) // 2
+            score = f"mate {moves if result.score > 0 else -moves}"
+        else:
+            score = f"cp {round(result.score * 100)}"
+        elapsed = max(result.elapsed, 1e-6)
+        self.send(f"info depth {result.depth} score {score} nodes {result.nodes} nps {int(result.nodes / elapsed)} "
+                  f"time {int(result.elapsed * 1000)} pv {' '.join(move.getNotation() for move in result.pv)}")
+
+    def waitForSearch(self):
+        """Stops a running search, if any, and waits for it to send its bestmove."""
+        if self.searchThread is not None:
+            self.clock.stop()
+            self.released.set()
+            self.searchThread.join()
+            self.searchThread = None
+
+    def close(self):
+        self.waitForSearch()
+        if self.parallelSearch is not None:
+            self.parallelSearch.close()
+
+def main():
+    UCIEngine().run()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+LONG-LIVED SEARCH PROCESS - KEEPS ITS OWN GAME AND SEARCH TABLES BETWEEN MOVES
+
+The worker is started once. It is sent moves in coordinate notation rather than a pickled
+ChessGame, so the cost of handing over a position does not grow with the game, and its
+transposition table stays warm from one move to the next.
+"""
+import random
+import time
+from multiprocessing import Process, Queue, Value
+from multiprocessing.shared_memory import SharedMemory
+from queue import Empty
+from chessEngine import ChessGame, START_FEN
+import chessAI
+
+################################################################################
+#  REPORTS SENT BACK BY THE WORKER
+################################################################################
+class SearchReport:
+    def __init__(self, searchID, final, move, score, depth, pv, nodes, elapsed):
+        self.searchID = searchID
+        self.final = final      # False for the progress report of a completed iteration
+        self.move = move        # coordinate notation, e.g. 'e2e4'
+        self.score = score
+        self.depth = depth
+        self.pv = pv            # list of coordinate notation moves
+        self.nodes = nodes
+        self.elapsed = elapsed
+
+def makeReport(searchID, final, result):
+    return SearchReport(searchID, final, result.move.getNotation() if result.move else None, result.score,
+                        result.depth, [move.getNotation() for move in result.pv], result.nodes, result.elapsed)
+
+################################################################################
+#  WORKER PROCESS
+################################################################################
+class StopFlag:
+    """Looks like a threading.Event to the search. It is set once the handle has stopped every
+    search up to this one, so stopping a search can never leak into the one started after it,
+    or once the deadline (wall clock seconds, 0 for none) set by a ponder hit has passed."""
+    def __init__(self, stoppedUpTo, searchID, deadline):
+        self.stoppedUpTo = stoppedUpTo
+        self.searchID = searchID
+        self.deadline = deadline
+
+    def is_set(self):
+        if self.stoppedUpTo.value >= self.searchID:
+            return True
+        deadline = self.deadline.value
+        return deadline != 0 and time.time() >= deadline
+
+def workerLoop(commands, reports, stoppedUpTo, deadline, sharedTable=None):
+    # forked workers inherit the parent's random state; reseed so root tie-breaks differ between them
+    random.seed()
+    if sharedTable is not None:
+        # search into a transposition table shared with other processes instead of a private one
+        name, sizeMB = sharedTable
+        sharedMemory = SharedMemory(name=name)
+        chessAI.transpositionTable = chessAI.TranspositionTable(sizeMB, sharedMemory.buf)
+    gc = ChessGame()
+    while True:
+        command = commands.get()
+        kind = command[0]
+        if kind == 'quit':
+            break
+        elif kind == 'newgame':
+            gc = ChessGame(command[1])
+            chessAI.transpositionTable.clear()
+        elif kind == 'move':
+            move = gc.parseMove(command[1])
+            if move is None:
+                raise ValueError(f"search worker was sent illegal move '{command[1]}'")
+            gc.movePiece(move)
+        elif kind == 'undo':
+            gc.undoMove()
+        elif kind == 'go':
+            searchID, timeLimit, nodeLimit, maxDepth, startDepth, reportIterations = command[1:]
+            validMoves = gc.getAllLegalMoves()
+            onIteration = (lambda result: reports.put(makeReport(searchID, False, result))) if reportIterations else None
+            result = chessAI.findBestMove(gc, validMoves, timeLimit=timeLimit, nodeLimit=nodeLimit, maxDepth=maxDepth,
+                                          stopEvent=StopFlag(stoppedUpTo, searchID, deadline), onIteration=onIteration,
+                                          startDepth=startDepth)
+            reports.put(makeReport(searchID, True, result))
+    if sharedTable is not None:
+        chessAI.transpositionTable.release()
+        sharedMemory.close()
+
+################################################################################
+#  HANDLE USED BY THE GUI AND OTHER FRONT ENDS
+################################################################################
+class SearchWorker:
+    def __init__(self, fen=START_FEN, sharedTable=None):
+        """sharedTable is an optional (SharedMemory name, size in MB) pair naming a transposition
+        table the worker should share with other processes."""
+        self.commands = Queue()
+        self.reports = Queue()
+        self.stoppedUpTo = Value('q', 0, lock=False)  # ID of the last search that was told to stop
+        self.deadline = Value('d', 0.0, lock=False)   # time.time() a pondering search must stop at once it is hit
+        self.process = Process(target=workerLoop, args=(self.commands, self.reports, self.stoppedUpTo, self.deadline, sharedTable),
+                               daemon=True)
+        self.process.start()
+        self.searchID = 0
+        self.ponderID = None  # ID of the search pondering the position in syncedMoves, until it is hit or replaced
+        self.newGame(fen)
+
+    def newGame(self, fen=START_FEN):
+        self.stop()
+        self.startFEN = fen
+        self.syncedMoves = []  # notation of the moves the worker has played from fen
+        self.commands.put(('newgame', fen))
+
+    def sync(self, gc):
+        """Brings the worker's game in line with gc by sending only the moves that changed
+        since the last sync (undos included)."""
+        if gc.startFEN != self.startFEN:
+            self.newGame(gc.startFEN)
+        moves = [move.getNotation() for move in gc.moveLog]
+        common = 0
+        while common < len(moves) and common < len(self.syncedMoves) and moves[common] == self.syncedMoves[common]:
+            common += 1
+        for i in range(len(self.syncedMoves) - common):
+            self.commands.put(('undo',))
+        for notation in moves[common:]:
+            self.commands.put(('move', notation))
+        self.syncedMoves = moves
+
+    def startSearch(self, gc, timeLimit=chessAI.TIME_LIMIT, nodeLimit=None, maxDepth=chessAI.MAX_DEPTH,
+                    startDepth=1, reportIterations=True):
+        """Searches gc's current position in the worker. Reports arrive through poll()."""
+        self.stop()
+        self.sync(gc)
+        self.deadline.value = 0.0
+        self.searchID += 1
+        self.ponderID = None
+        self.commands.put(('go', self.searchID, timeLimit, nodeLimit, maxDepth, startDepth, reportIterations))
+        return self.searchID
+
+    def ponder(self, gc, expectedMove=None, maxDepth=chessAI.MAX_DEPTH):
+        """Searches without a time limit while the opponent thinks: the position after
+        expectedMove (coordinate notation) when there is a guess, otherwise gc's position itself,
+        which still fills the tables for whatever reply comes. See ponderHit."""
+        self.stop()
+        self.sync(gc)
+        if expectedMove is not None:
+            self.commands.put(('move', expectedMove))
+            self.syncedMoves.append(expectedMove)
+        self.deadline.value = 0.0
+        self.searchID += 1
+        self.ponderID = self.searchID
+        self.commands.put(('go', self.searchID, None, None, maxDepth, 1, True))
+        return self.searchID
+
+    def ponderHit(self, gc, timeLimit=chessAI.TIME_LIMIT):
+        """If gc has reached the position being pondered, the pondering search becomes the real one
+        with timeLimit more seconds to run, and True is returned; its reports then arrive through
+        poll() as usual. Otherwise nothing changes and a new search has to be started."""
+        if self.ponderID != self.searchID or gc.startFEN != self.startFEN:
+            return False
+        if [move.getNotation() for move in gc.moveLog] != self.syncedMoves:
+            return False
+        self.deadline.value = time.time() + timeLimit
+        self.ponderID = None
+        return True
+
+    def stop(self):
+        # the worker finishes its current node check and still reports the best move so far
+        self.stoppedUpTo.value = self.searchID
+
+    def poll(self, timeout=None):
+        """Returns the next report of the latest search, or None if there is none yet. Reports
+        from searches that were stopped and replaced are dropped."""
+        while True:
+            try:
+                report = self.reports.get(timeout=timeout) if timeout is not None else self.reports.get_nowait()
+            except Empty:
+                return None
+            if report.searchID == self.searchID:
+                return report
+
+    def waitForResult(self, timeout=None):
+        while True:
+            report = self.poll(timeout if timeout is not None else 3600)
+            if report is None or report.final:
+                return report
+
+    def close(self):
+        self.stop()
+        self.commands.put(('quit',))
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
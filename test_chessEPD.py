@@ -0,0 +1,29 @@
+import io
+import json
+import chessAI
+import chessEPD
+
+LINES = ["garbage line",
+         "4k3/8/8/8/8/8/8/3pK3 b - - bm Kd2; id \"pawn on the first rank\";",
+         "6k1/5ppp/8/8/8/8/8/R5K1 w - - bm Ra8; id \"back rank mate\";"]
+
+def analyse(lines):
+    out = io.StringIO()
+    settings = chessEPD.AnalysisSettings(maxDepth=2, ttSizeMB=1)
+    chessEPD.writeResults(chessEPD.analyseStream(chessEPD.readEPD(lines), settings), out)
+    return [json.loads(line) for line in out.getvalue().splitlines()]
+
+def test_bad_lines_become_error_records():
+    results = analyse(LINES)
+    assert [result["line"] for result in results] == [1, 2, 3]
+    assert "invalid EPD" in results[0]["error"]
+    assert "first or last rank" in results[1]["error"]
+    assert results[2]["san"] == "Ra8#" and results[2]["solved"]
+
+def test_search_failure_becomes_error_record(monkeypatch):
+    def failingSearch(*args, **kwargs):
+        raise IndexError("list index out of range")
+    monkeypatch.setattr(chessAI, "findBestMove", failingSearch)
+    results = analyse(LINES[2:] * 2)
+    assert [result["error"] for result in results] == ["IndexError: list index out of range"] * 2
+    assert [result["id"] for result in results] == ["back rank mate"] * 2